@@ -36,9 +36,16 @@
 __docformat__ = "javadoc"
 
 from array import array
-from binascii import hexlify, unhexlify
-from bisect import bisect_right
+from binascii import crc_hqx, hexlify, unhexlify
+from functools import partial
+from heapq import heapify, heappop, heapreplace
+from itertools import chain, islice
+from zlib import adler32, crc32
+import hashlib
+import json
 import os
+import re
+import struct
 import sys
 
 from intelhex.compat import (
@@ -56,6 +63,7 @@ from intelhex.compat import (
     )
 
 from intelhex.getsizeof import total_size
+from intelhex.storage import DictStorage, ExtentStorage, LazyStorage
 
 
 class _DeprecatedParam(object):
@@ -67,13 +75,21 @@ _DEPRECATED = _DeprecatedParam()
 class IntelHex(object):
     ''' Intel HEX file reader. '''
 
-    def __init__(self, source=None):
+    _LOADHEX_CHUNK = 16384      # number of lines decoded in bulk by loadhex
+
+    def __init__(self, source=None, storage=None, lazy=False, index=None):
         ''' Constructor. If source specified, object will be initialized
         with the contents of source. Otherwise the object will be empty.
 
         @param  source      source for initialization
                             (file name of HEX file, file object, addr dict or
                              other IntelHex object)
+        @param  storage     storage backend class for data
+                            (ExtentStorage by default, DictStorage
+                             for legacy one dict entry per byte storage)
+        @param  lazy        load HEX file lazily (see loadhex)
+        @param  index       keep index of lazily loaded HEX file
+                            (see loadhex)
         '''
         # public members
         self.padding = 0x0FF
@@ -81,23 +97,40 @@ class IntelHex(object):
         self.start_addr = None
 
         # private members
+        self._storage = storage or ExtentStorage
         self._buf = {}
         self._offset = 0
 
         if source is not None:
             if isinstance(source, StrType) or getattr(source, "read", None):
                 # load hex file
-                self.loadhex(source)
+                self.loadhex(source, lazy=lazy, index=index)
             elif isinstance(source, dict):
                 self.fromdict(source)
             elif isinstance(source, IntelHex):
                 self.padding = source.padding
                 if source.start_addr:
                     self.start_addr = source.start_addr.copy()
-                self._buf = source._buf.copy()
+                if storage is None:
+                    self._storage = source._storage
+                    self._buf = source._buf.copy()
+                else:
+                    self._buf.update(source._buf)
             else:
                 raise ValueError("source: bad initializer type")
 
+    def _get_buf(self):
+        return self.__dict__['_buf']
+
+    def _set_buf(self, buf):
+        # plain dict is converted into storage object
+        if getattr(buf, 'extents', None) is None:
+            buf = self._storage(buf)
+        self.__dict__['_buf'] = buf
+
+    _buf = property(_get_buf, _set_buf,
+                    doc='Storage object with data (see intelhex.storage)')
+
     def _decode_record(self, s, line=0):
         '''Decode one record of HEX file.
 
@@ -106,124 +139,203 @@ class IntelHex(object):
 
         @raise  EndOfFile   if EOF record encountered.
         '''
-        s = s.rstrip('\r\n')
-        if not s:
-            return          # empty line
-
-        if s[0] == ':':
-            try:
-                bin = array('B', unhexlify(asbytes(s[1:])))
-            except (TypeError, ValueError):
-                # this might be raised by unhexlify when odd hexascii digits
-                raise HexRecordError(line=line)
-            length = len(bin)
-            if length < 5:
-                raise HexRecordError(line=line)
-        else:
-            raise HexRecordError(line=line)
-
-        record_length = bin[0]
-        if length != (5 + record_length):
-            raise RecordLengthError(line=line)
-
-        addr = bin[1]*256 + bin[2]
-
-        record_type = bin[3]
-        if not (0 <= record_type <= 5):
-            raise RecordTypeError(line=line)
-
-        crc = sum(bin)
-        crc &= 0x0FF
-        if crc != 0:
-            raise RecordChecksumError(line=line)
-
-        if record_type == 0:
-            # data record
-            addr += self._offset
-            for i in range_g(4, 4+record_length):
-                if not self._buf.get(addr, None) is None:
-                    raise AddressOverlapError(address=addr, line=line)
-                self._buf[addr] = bin[i]
-                addr += 1   # FIXME: addr should be wrapped 
-                            # BUT after 02 record (at 64K boundary)
-                            # and after 04 record (at 4G boundary)
-
-        elif record_type == 1:
-            # end of file record
-            if record_length != 0:
-                raise EOFRecordError(line=line)
-            raise _EndOfFile
-
-        elif record_type == 2:
-            # Extended 8086 Segment Record
-            if record_length != 2 or addr != 0:
-                raise ExtendedSegmentAddressRecordError(line=line)
-            self._offset = (bin[4]*256 + bin[5]) * 16
-
-        elif record_type == 4:
-            # Extended Linear Address Record
-            if record_length != 2 or addr != 0:
-                raise ExtendedLinearAddressRecordError(line=line)
-            self._offset = (bin[4]*256 + bin[5]) * 65536
-
-        elif record_type == 3:
-            # Start Segment Address Record
-            if record_length != 4 or addr != 0:
-                raise StartSegmentAddressRecordError(line=line)
-            if self.start_addr:
-                raise DuplicateStartAddressRecordError(line=line)
-            self.start_addr = {'CS': bin[4]*256 + bin[5],
-                               'IP': bin[6]*256 + bin[7],
-                              }
-
-        elif record_type == 5:
-            # Start Linear Address Record
-            if record_length != 4 or addr != 0:
-                raise StartLinearAddressRecordError(line=line)
-            if self.start_addr:
-                raise DuplicateStartAddressRecordError(line=line)
-            self.start_addr = {'EIP': (bin[4]*16777216 +
-                                       bin[5]*65536 +
-                                       bin[6]*256 +
-                                       bin[7]),
-                              }
-
-    def loadhex(self, fobj):
+        decoder = _HexDecoder()
+        decoder.offset = self._offset
+        decoder.line = line - 1
+        decoder.start_addr = bool(self.start_addr)
+        for line, record_type, addr, data in decoder.decode([s]):
+            if record_type == 0:
+                # data record
+                for byte in data:
+                    if not self._buf.get(addr, None) is None:
+                        raise AddressOverlapError(address=addr, line=line)
+                    self._buf[addr] = byte
+                    addr += 1   # FIXME: addr should be wrapped
+                                # BUT after 02 record (at 64K boundary)
+                                # and after 04 record (at 4G boundary)
+            elif record_type == 1:
+                # end of file record
+                raise _EndOfFile
+            elif record_type in (3, 5):
+                # Start Segment/Linear Address Record
+                self.start_addr = _record_start_addr(record_type, data)
+        self._offset = decoder.offset
+
+    def loadhex(self, fobj, lazy=False, index=None):
         """Load hex file into internal buffer. This is not necessary
         if object was initialized with source set. This will overwrite
         addresses if object was already initialized.
 
+        File is decoded in big chunks of lines, runs of contiguous
+        data records are written to storage as single blocks.
+
         @param  fobj        file name or file-like object
+        @param  lazy        if True and fobj is file name, file is only
+                            scanned for positions and address ranges of
+                            runs of data records; records are decoded when
+                            their addresses are accessed (see LazyStorage).
+                            Errors in data records are reported on access
+                            in this case. File should not be changed while
+                            object is in use. Lazy loading is used only
+                            for empty object with ExtentStorage, otherwise
+                            (or if file can't be indexed) the file
+                            is decoded as usual.
+        @param  index       keep index of lazily loaded file to skip scan
+                            of the file next time: True to save index next
+                            to the file (fobj + '.idx'), or name of cache
+                            directory. Index is used only while size,
+                            modification time and hash of beginning and
+                            end of the file are the same.
         """
+        if (lazy and isinstance(fobj, StrType) and
+                issubclass(self._storage, ExtentStorage) and
+                not len(self._buf) and self.start_addr is None and
+                self._loadhex_lazy(fobj, index)):
+            return
         if getattr(fobj, "read", None) is None:
             fobj = open(fobj, "r")
             fclose = fobj.close
         else:
             fclose = None
 
-        self._offset = 0
-        line = 0
+        decoder = _HexDecoder()
+        decoder.start_addr = bool(self.start_addr)
+        run_start = run_end = None
+        run_data = []   # payloads of contiguous data records
+        run_lines = []  # line numbers of records in the run
 
         try:
-            decode = self._decode_record
-            try:
-                for s in fobj:
-                    line += 1
-                    decode(s, line)
-            except _EndOfFile:
-                pass
+            for records in decoder.iter_chunks(fobj, self._LOADHEX_CHUNK):
+                for line, record_type, addr, data in records:
+                    if record_type == 0:
+                        if not data:
+                            continue    # empty record doesn't overlap
+                        if addr != run_end:
+                            if run_data:
+                                self._write_records(run_start, run_end,
+                                                    run_data, run_lines)
+                            run_start = run_end = addr
+                            run_data = []
+                            run_lines = []
+                        run_data.append(data)
+                        run_lines.append(line)
+                        run_end += len(data)
+                    elif record_type in (3, 5):
+                        self.start_addr = _record_start_addr(record_type,
+                                                             data)
+                if run_data:
+                    # check the run before errors of the next records
+                    self._check_overlap(run_start, run_end, run_data,
+                                        run_lines)
+            if run_data:
+                self._write_records(run_start, run_end, run_data, run_lines)
         finally:
+            self._offset = decoder.offset
             if fclose:
                 fclose()
 
-    def loadbin(self, fobj, offset=0):
+    def _loadhex_lazy(self, fname, index=None):
+        """Index hex file and set up lazy storage for its data.
+        @param  fname   name of hex file.
+        @param  index   where to keep persistent index (see loadhex).
+        @return         False if file can't be indexed.
+        """
+        f = open(fname, 'rb')
+        try:
+            stamp = _file_stamp(f)
+            indexer = path = None
+            if index is not None:
+                key = _HexIndexer.key(f, stamp)
+                if index is True:
+                    path = fname + '.idx'
+                else:
+                    path = os.path.join(index, key + '.idx')
+                indexer = _HexIndexer.load(path, key)
+            if indexer is None:
+                indexer = _HexIndexer()
+                f.seek(0)
+                indexer.indexed = indexer.scan(f)
+                if path is not None:
+                    indexer.save(path, key)
+        finally:
+            f.close()
+        if not indexer.indexed:
+            return False
+        self._buf = LazyStorage(regions=[
+            (run[0], run[1], partial(_load_hex_run, fname, stamp, tuple(run)))
+            for run in indexer.runs])
+        self.start_addr = indexer.start_addr
+        self._offset = indexer.offset
+        return True
+
+    def _write_records(self, start, end, data, lines):
+        """Write payloads of contiguous data records to storage
+        as one block, checking for overlap with existing data.
+
+        @param  start   address of the first record.
+        @param  end     address after the last record.
+        @param  data    list of records payloads.
+        @param  lines   list of records line numbers (for error messages).
+        """
+        self._check_overlap(start, end, data, lines)
+        self._buf.write(start, b''.join(data))
+
+    def _check_overlap(self, start, end, data, lines):
+        """Check that contiguous data records don't overlap existing data.
+        Arguments are the same as for _write_records.
+        @raise  AddressOverlapError  for the first overlapped record.
+        """
+        for addr, _ in self._buf.extents(start, end):
+            # find the record with first overlapped address
+            for payload, line in zip(data, lines):
+                start += len(payload)
+                if start > addr:
+                    break
+            raise AddressOverlapError(address=addr, line=line)
+
+    def loadbin(self, fobj, offset=0, mapped=False, write_through=False):
         """Load bin file into internal buffer. Not needed if source set in
         constructor. This will overwrite addresses without warning
         if object was already initialized.
 
         @param  fobj        file name or file-like object
         @param  offset      starting address offset
+        @param  mapped      if True, file is mapped into memory with mmap
+                            instead of reading: data is read from
+                            the file only when it is accessed.
+                            Changes of data stay in memory (copy-on-write)
+                            unless write_through is set. If file can't be
+                            mapped (not a real file, empty file) it is
+                            read as usual.
+        @param  write_through   if True (with mapped), changes of bytes
+                            of mapped data are written to the file
+                            (file name or file opened for reading and
+                            writing is required). Operations which add
+                            or remove bytes of the data continue with
+                            a copy in memory.
+
+        @raise  ValueError  if write_through is requested but data
+                            can't be mapped for writing.
         """
+        if mapped:
+            view = _map_file(fobj, write_through)
+            if view is not None:
+                attach = getattr(self._buf, 'attach', None)
+                try:
+                    if attach is None:
+                        raise ValueError
+                    attach(offset, view)
+                    return
+                except ValueError:
+                    if write_through:
+                        raise ValueError('mapped data should not touch '
+                                         'other data of object')
+                # nobody else has writable reference to this mapping
+                self.frombytes(view.toreadonly(), offset=offset, copy=False)
+                return
+            if write_through:
+                raise ValueError('file can not be mapped for writing')
+
         fread = getattr(fobj, "read", None)
         if fread is None:
             f = open(fobj, "rb")
@@ -233,11 +345,97 @@ class IntelHex(object):
             fclose = None
 
         try:
-            self.frombytes(array('B', asbytes(fread())), offset=offset)
+            # nobody else has reference to this bytes object
+            self.frombytes(asbytes(fread()), offset=offset, copy=False)
         finally:
             if fclose:
                 fclose()
 
+    def load_snapshot(self, fobj, mapped=False, verify=True):
+        """Load snapshot file written by save_snapshot. Data is read
+        into one preallocated buffer (or mapped into memory) and its
+        segments are stored without copying. This will overwrite
+        addresses without warning if object was already initialized.
+        Padding and start address are set from the snapshot.
+
+        @param  fobj        file name or file-like object
+                            opened in binary mode
+        @param  mapped      if True, file is mapped into memory with mmap
+                            (if possible) instead of reading. Changes
+                            of data are never written to the file.
+        @param  verify      check checksum of data if snapshot has it.
+
+        @raise  SnapshotError   if file is not a valid snapshot.
+        """
+        if getattr(fobj, "read", None) is None:
+            f = open(fobj, "rb")
+        else:
+            f = fobj
+        try:
+            view = None
+            if mapped:
+                view = _map_file(f)
+            if view is None:
+                header = _read_exactly(f, _SNAPSHOT_HEADER.size)
+            else:
+                header = view[:_SNAPSHOT_HEADER.size].tobytes()
+            if len(header) != _SNAPSHOT_HEADER.size:
+                raise SnapshotError(reason='file is too short')
+            (magic, version, flags, padding, start_mask, cs, ip, eip,
+             count, crc) = _SNAPSHOT_HEADER.unpack(header)
+            if magic != _SNAPSHOT_MAGIC:
+                raise SnapshotError(reason='bad signature')
+            if version != _SNAPSHOT_VERSION:
+                raise SnapshotError(reason='unsupported version %d'
+                                    % version)
+            pos = _SNAPSHOT_HEADER.size
+            if view is None:
+                raw = _read_exactly(f, 16*count)
+            else:
+                raw = view[pos:pos+16*count]
+            if len(raw) != 16*count:
+                raise SnapshotError(reason='file is too short')
+            table = array('Q')
+            table.frombytes(raw)
+            pos += 16*count
+            if sys.byteorder == 'big':
+                table.byteswap()
+            size = sum(table[1::2])
+            if view is None:
+                data = memoryview(bytearray(size))
+                if _read_into(f, data) != size:
+                    raise SnapshotError(reason='file is too short')
+            else:
+                data = view[pos:pos+size]
+                if len(data) != size:
+                    raise SnapshotError(reason='file is too short')
+        finally:
+            if f is not fobj:
+                f.close()   # mapping stays valid after closing the file
+        if verify and flags & _SNAPSHOT_CHECKSUM:
+            if crc32(data, crc32(raw)) != crc:
+                raise SnapshotError(reason='checksum mismatch')
+        # data buffer is not shared with anybody: keep writable views
+        # of it if storage allows, or read-only views otherwise
+        attach = getattr(self._buf, 'attach', None)
+        pos = 0
+        for i in range_g(0, len(table), 2):
+            addr, n = table[i], table[i+1]
+            segment = data[pos:pos+n]
+            pos += n
+            try:
+                if attach is None:
+                    raise ValueError
+                attach(addr, segment)
+            except ValueError:
+                self._buf.write(addr, segment.toreadonly(), copy=False)
+        self.padding = padding
+        start_addr = {}
+        for bit, key, value in ((1, 'CS', cs), (2, 'IP', ip), (4, 'EIP', eip)):
+            if start_mask & bit:
+                start_addr[key] = value
+        self.start_addr = start_addr or None
+
     def loadfile(self, fobj, format):
         """Load data file into internal buffer. Preferred wrapper over
         loadbin or loadhex.
@@ -278,20 +476,40 @@ class IntelHex(object):
         if start_addr is not None:
             self.start_addr = start_addr
 
-    def frombytes(self, bytes, offset=0):
+    def frombytes(self, bytes, offset=0, copy=True):
         """Load data from array or list of bytes.
         Similar to loadbin() method but works directly with iterable bytes.
+        Objects with buffer protocol (bytes, bytearray, memoryview, mmap,
+        array of bytes) are stored as one block of data.
+
+        @param  bytes       bytes-like object or iterable of bytes.
+        @param  offset      starting address offset.
+        @param  copy        if False, object keeps reference to bytes-like
+                            object instead of copying it (if loaded block
+                            does not touch existing data). Caller should
+                            not change the object after that.
         """
-        for b in bytes:
-            self._buf[offset] = b
-            offset += 1
+        try:
+            view = memoryview(bytes)
+        except TypeError:
+            view = None
+        if view is None or view.format not in ('B', 'c') or view.ndim != 1:
+            # list or array of other type: byte by byte as before
+            view = memoryview(bytearray(iter(bytes)))
+            copy = False
+        elif view.format == 'c':
+            view = view.cast('B')
+        if not view.contiguous:
+            view = memoryview(view.tobytes())
+            copy = False
+        self._buf.write(offset, view, copy=copy)
 
     def _get_start_end(self, start=None, end=None, size=None):
         """Return default values for start and end if they are None.
         If this IntelHex object is empty then it's error to
         invoke this method with both start and end as None. 
         """
-        if (start,end) == (None,None) and self._buf == {}:
+        if (start,end) == (None,None) and not self._buf:
             raise EmptyIntelHexError
         if size is not None:
             if None not in (start, end):
@@ -339,17 +557,33 @@ class IntelHex(object):
 
     def _tobinarray_really(self, start, end, pad, size):
         """Return binary array."""
+        bin = array('B')
+        for data in self._iter_bin(start, end, pad, size):
+            bin.frombytes(data)
+        return bin
+
+    def _iter_bin(self, start, end, pad, size):
+        """Iterate over parts of binary image: memoryviews which share
+        memory with storage for data and blocks of padding bytes for gaps.
+        Arguments are the same as for tobinarray.
+        """
         if pad is None:
             pad = self.padding
-        bin = array('B')
-        if self._buf == {} and None in (start, end):
-            return bin
+        if not self._buf and None in (start, end):
+            return
         if size is not None and size <= 0:
             raise ValueError("tobinarray: wrong value for size")
         start, end = self._get_start_end(start, end, size)
-        for i in range_g(start, end+1):
-            bin.append(self._buf.get(i, pad))
-        return bin
+        addr = start
+        for a, data in self._buf.extents(start, end+1):
+            if a > addr:
+                for block in _pad_blocks(pad, a - addr):
+                    yield block
+            yield data
+            addr = a + len(data)
+        if addr <= end:
+            for block in _pad_blocks(pad, end + 1 - addr):
+                yield block
 
     def tobinstr(self, start=None, end=None, pad=_DEPRECATED, size=None):
         ''' Convert to binary form and return as binary string.
@@ -373,7 +607,129 @@ class IntelHex(object):
         return self._tobinstr_really(start, end, pad, size)
 
     def _tobinstr_really(self, start, end, pad, size):
-        return array_tobytes(self._tobinarray_really(start, end, pad, size))
+        return b''.join(self._iter_bin(start, end, pad, size))
+
+    def tobinview(self, start=None, end=None, size=None):
+        ''' Convert to binary form and return as read-only memoryview.
+        If the whole range is filled with data (no padding needed)
+        the view shares memory with this object (with default extent
+        storage) and nothing is copied, so it is very cheap to get it
+        for checksums etc.
+        Otherwise the view is made over a padded copy of the data.
+        Shared view shows changes made to the data in place,
+        so it's better not to keep it while object is modified.
+        @param  start   start address of output bytes.
+        @param  end     end address of output bytes (inclusive).
+        @param  size    size of the block, used with start or end parameter.
+        @return         read-only memoryview of binary data.
+        '''
+        parts = list(self._iter_bin(start, end, None, size))
+        if len(parts) == 1 and isinstance(parts[0], memoryview):
+            return parts[0].toreadonly()
+        return memoryview(b''.join(parts))
+
+    def words(self, typecode='H', byteorder='little'):
+        '''Return view of data as 16-bit or 32-bit words.
+        View shares storage with this object: nothing is copied and
+        changes made via view or via this object are seen in both.
+        View has word addressing and methods of IntelHex16bit class
+        (indexing, tobinarray, getwords, putwords etc.).
+        @param  typecode    format of words: 'H' for 16-bit,
+                            'I' for 32-bit (as for array).
+        @param  byteorder   order of bytes in words: 'little' or 'big'.
+        @return             IntelHexWords object.
+        '''
+        return IntelHexWords(self, typecode, byteorder)
+
+    def _checksum(self, key, start, end, compute):
+        """Compute checksum of binary image with compute function
+        (which gets iterator of data blocks, see _iter_bin) or return
+        cached result. Results are kept until data is modified
+        (storage version is changed) and are kept for every range
+        and padding value.
+        """
+        buf = self._buf
+        version = getattr(buf, 'version', None)
+        if version is None:
+            return compute(self._iter_bin(start, end, None, None))
+        key += (start, end, self.padding)
+        cache = getattr(self, '_checksums', None)
+        if cache is not None and cache[0] is buf and cache[1] == version:
+            if key in cache[2]:
+                return cache[2][key]
+        else:
+            cache = None
+        value = compute(self._iter_bin(start, end, None, None))
+        if cache is None or buf.version != version:
+            # lazy storage could load data while computing
+            cache = self._checksums = (buf, buf.version, {})
+        cache[2][key] = value
+        return value
+
+    def crc32(self, start=None, end=None):
+        """Compute CRC-32 (as zlib.crc32) of binary image. Data and blocks
+        of padding are passed directly to zlib without building image.
+
+        @param  start   start address of range (minaddr by default).
+        @param  end     end address of range (inclusive,
+                        maxaddr by default).
+        @return         CRC as unsigned int.
+        """
+        def compute(blocks):
+            crc = 0
+            for data in blocks:
+                crc = crc32(data, crc)
+            return crc & 0x0FFFFFFFF
+        return self._checksum(('crc32',), start, end, compute)
+
+    def crc16(self, start=None, end=None, poly=0x1021, init=0x0FFFF):
+        """Compute CRC-16 of binary image (MSB first, without final XOR).
+        Defaults are for CRC-16/CCITT-FALSE, it's computed with
+        binascii.crc_hqx; other polynomials are computed with table
+        in Python.
+
+        @param  start   start address of range (minaddr by default).
+        @param  end     end address of range (inclusive,
+                        maxaddr by default).
+        @param  poly    CRC polynomial.
+        @param  init    initial value of CRC.
+        @return         CRC as unsigned int.
+        """
+        if poly == 0x1021:
+            def compute(blocks):
+                crc = init
+                for data in blocks:
+                    crc = crc_hqx(data, crc)
+                return crc
+        else:
+            table = _crc16_table(poly)
+            def compute(blocks):
+                crc = init
+                for data in blocks:
+                    for byte in bytearray(data):
+                        crc = ((crc << 8) & 0x0FF00) ^ table[(crc >> 8) ^ byte]
+                return crc
+        return self._checksum(('crc16', poly, init), start, end, compute)
+
+    def digest(self, name='sha256', start=None, end=None):
+        """Compute digest of binary image with hashlib algorithm.
+        Data and blocks of padding are passed directly to hash object
+        without building image.
+
+        @param  name    name of hashlib algorithm ('sha256', 'md5' etc.).
+        @param  start   start address of range (minaddr by default).
+        @param  end     end address of range (inclusive,
+                        maxaddr by default).
+        @return         digest as bytes.
+
+        @raise  ValueError  if algorithm is not supported.
+        """
+        h = hashlib.new(name)
+        def compute(blocks):
+            for data in blocks:
+                h.update(data)
+            return h.digest()
+        return self._checksum(('digest', h.name), start, end, compute)
 
     def tobinfile(self, fobj, start=None, end=None, pad=_DEPRECATED, size=None):
         '''Convert to binary and write to file.
@@ -401,10 +757,12 @@ class IntelHex(object):
         else:
             close_fd = False
 
-        fobj.write(self._tobinstr_really(start, end, pad, size))
-
-        if close_fd:
-            fobj.close()
+        try:
+            for data in self._iter_bin(start, end, pad, size):
+                fobj.write(data)
+        finally:
+            if close_fd:
+                fobj.close()
 
     def todict(self):
         '''Convert to python dictionary.
@@ -412,38 +770,36 @@ class IntelHex(object):
         @return         dict suitable for initializing another IntelHex object.
         '''
         r = {}
-        r.update(self._buf)
+        r.update(self._buf.items())
         if self.start_addr:
             r['start_addr'] = self.start_addr
         return r
 
-    def addresses(self):
+    def addresses(self, lazy=False):
         '''Returns all used addresses in sorted order.
-        @return         list of occupied data addresses in sorted order. 
+        @param  lazy    return iterator instead of list: addresses are
+                        produced from segments one by one, without
+                        building list with all of them.
+        @return         list (or iterator) of occupied data addresses
+                        in sorted order.
         '''
-        aa = dict_keys(self._buf)
-        aa.sort()
-        return aa
+        aa = chain.from_iterable([range_g(start, stop)
+                                  for start, stop in self.segments()])
+        if lazy:
+            return aa
+        return list(aa)
 
     def minaddr(self):
         '''Get minimal address of HEX content.
         @return         minimal address or None if no data
         '''
-        aa = dict_keys(self._buf)
-        if aa == []:
-            return None
-        else:
-            return min(aa)
+        return self._buf.minaddr()
 
     def maxaddr(self):
         '''Get maximal address of HEX content.
         @return         maximal address or None if no data
         '''
-        aa = dict_keys(self._buf)
-        if aa == []:
-            return None
-        else:
-            return max(aa)
+        return self._buf.maxaddr()
 
     def __contains__(self, addr):
         ''' Returns a boolean if the address is present.
@@ -464,22 +820,24 @@ class IntelHex(object):
         if t in IntTypes:
             if addr < 0:
                 raise TypeError('Address should be >= 0.')
-            addresses = dict_keys(self._buf)
-            if not addresses or addr > max(addresses):
+            maxaddr = self._buf.maxaddr()
+            if maxaddr is None or addr > maxaddr:
                 raise IndexError
             return self._buf.get(addr, self.padding)
         elif t == slice:
-            addresses = dict_keys(self._buf)
             ih = IntelHex()
-            if addresses:
-                addresses.sort()
-                start = addr.start if addr.start is not None else addresses[0]
-                stop = addr.stop if addr.stop is not None else addresses[-1] + 1
+            buf = self._buf
+            if buf:
+                start = addr.start if addr.start is not None else buf.minaddr()
+                stop = addr.stop if addr.stop is not None else buf.maxaddr() + 1
                 step = addr.step or 1
-                for i in range_g(start, stop, step):
-                    x = self._buf.get(i)
-                    if x is not None:
-                        ih[i] = x
+                for first, data, step in self._slice_extents(start, stop, step):
+                    if step == 1:
+                        ih._buf.write(first, data)
+                    else:
+                        for x in data:
+                            ih._buf[first] = x
+                            first += step
             return ih
         else:
             raise TypeError('Address has unsupported type: %s' % t)
@@ -492,13 +850,19 @@ class IntelHex(object):
                 raise TypeError('Address should be >= 0.')
             self._buf[addr] = byte
         elif t == slice:
-            if not isinstance(byte, (list, tuple)):
+            if not isinstance(byte, (list, tuple, bytes, bytearray, memoryview)):
                 raise ValueError('Slice operation expects sequence of bytes')
+            if isinstance(byte, memoryview) and byte.format != 'B':
+                # length of view is in items, storage needs bytes
+                if byte.c_contiguous:
+                    byte = byte.cast('B')
+                else:
+                    byte = memoryview(byte.tobytes())
             start = addr.start
             stop = addr.stop
             step = addr.step or 1
             if None not in (start, stop):
-                ra = range_l(start, stop, step)
+                ra = range_g(start, stop, step)
                 if len(ra) != len(byte):
                     raise ValueError('Length of bytes sequence does not match '
                         'address range')
@@ -512,10 +876,15 @@ class IntelHex(object):
                 raise TypeError('start address cannot be negative')
             if stop < 0:
                 raise TypeError('stop address cannot be negative')
-            j = 0
-            for i in range_g(start, stop, step):
-                self._buf[i] = byte[j]
-                j += 1
+            if isinstance(byte, (list, tuple)):
+                byte = bytearray(byte)
+            if step == 1:
+                self._buf.write(start, byte)
+            else:
+                j = 0
+                for i in range_g(start, stop, step):
+                    self._buf[i] = byte[j]
+                    j += 1
         else:
             raise TypeError('Address has unsupported type: %s' % t)
 
@@ -527,22 +896,55 @@ class IntelHex(object):
                 raise TypeError('Address should be >= 0.')
             del self._buf[addr]
         elif t == slice:
-            addresses = dict_keys(self._buf)
-            if addresses:
-                addresses.sort()
-                start = addr.start or addresses[0]
-                stop = addr.stop or (addresses[-1]+1)
+            buf = self._buf
+            if buf:
+                start = addr.start or buf.minaddr()
+                stop = addr.stop or (buf.maxaddr()+1)
                 step = addr.step or 1
-                for i in range_g(start, stop, step):
-                    x = self._buf.get(i)
-                    if x is not None:
-                        del self._buf[i]
+                if step == 1:
+                    buf.delete(start, stop)
+                    return
+                # addresses are collected first: views of storage
+                # should not be kept while it's modified
+                addresses = []
+                for first, data, step in self._slice_extents(start, stop, step):
+                    addresses.extend(range_g(first, first + len(data)*step, step))
+                for i in addresses:
+                    del buf[i]
         else:
             raise TypeError('Address has unsupported type: %s' % t)
 
+    def _slice_extents(self, start, stop, step):
+        """Iterate over data selected by slice with time proportional
+        to size of occupied data inside the slice range.
+
+        @param  start   start of slice.
+        @param  stop    stop of slice.
+        @param  step    step of slice (not 0).
+        @return         iterator of (address, data, step) tuples: data is
+                        memoryview of storage with bytes at addresses
+                        address, address+step, ... in ascending order;
+                        step is absolute value of slice step.
+        """
+        ra = range_g(start, stop, step)
+        if not ra:
+            return
+        if step > 0:
+            lo = ra[0]
+            hi = ra[-1] + 1
+        else:
+            # the same addresses in ascending order
+            lo = ra[-1]
+            hi = ra[0] + 1
+            step = -step
+        for a, data in self._buf.extents(lo, hi):
+            first = a + (lo - a) % step     # first selected address >= a
+            if first < a + len(data):
+                yield first, data[first-a::step], step
+
     def __len__(self):
         """Return count of bytes with real values."""
-        return len(dict_keys(self._buf))
+        return len(self._buf)
 
     def _get_eol_textfile(eolstyle, platform):
         if eolstyle == 'native':
@@ -582,16 +984,7 @@ class IntelHex(object):
 
         eol = IntelHex._get_eol_textfile(eolstyle, sys.platform)
 
-        # Translation table for uppercasing hex ascii string.
-        # timeit shows that using hexstr.translate(table)
-        # is faster than hexstr.upper():
-        # 0.452ms vs. 0.652ms (translate vs. upper)
-        if sys.version_info[0] >= 3:
-            # Python 3
-            table = bytes(range_l(256)).upper()
-        else:
-            # Python 2
-            table = ''.join(chr(i).upper() for i in range_g(256))
+        table = _HexEncoder.table
 
         # start address record if any
         if self.start_addr and write_start_addr:
@@ -635,92 +1028,72 @@ class IntelHex(object):
                 raise InvalidStartAddressValueError(start_addr=self.start_addr)
 
         # data
-        addresses = dict_keys(self._buf)
-        addresses.sort()
-        addr_len = len(addresses)
-        if addr_len:
-            minaddr = addresses[0]
-            maxaddr = addresses[-1]
-
-            if maxaddr > 65535:
-                need_offset_record = True
-            else:
-                need_offset_record = False
-            high_ofs = 0
-
-            cur_addr = minaddr
-            cur_ix = 0
-
-            while cur_addr <= maxaddr:
-                if need_offset_record:
-                    bin = array('B', asbytes('\0'*7))
-                    bin[0] = 2      # reclen
-                    bin[1] = 0      # offset msb
-                    bin[2] = 0      # offset lsb
-                    bin[3] = 4      # rectyp
-                    high_ofs = int(cur_addr>>16)
-                    b = divmod(high_ofs, 256)
-                    bin[4] = b[0]   # msb of high_ofs
-                    bin[5] = b[1]   # lsb of high_ofs
-                    bin[6] = (-sum(bin)) & 0x0FF    # chksum
-                    fwrite(':' +
-                           asstr(hexlify(array_tobytes(bin)).translate(table)) +
-                           eol)
-
-                while True:
-                    # produce one record
-                    low_addr = cur_addr & 0x0FFFF
-                    # chain_len off by 1
-                    chain_len = min(byte_count-1, 65535-low_addr, maxaddr-cur_addr)
-
-                    # search continuous chain
-                    stop_addr = cur_addr + chain_len
-                    if chain_len:
-                        ix = bisect_right(addresses, stop_addr,
-                                          cur_ix,
-                                          min(cur_ix+chain_len+1, addr_len))
-                        chain_len = ix - cur_ix     # real chain_len
-                        # there could be small holes in the chain
-                        # but we will catch them by try-except later
-                        # so for big continuous files we will work
-                        # at maximum possible speed
-                    else:
-                        chain_len = 1               # real chain_len
-
-                    bin = array('B', asbytes('\0'*(5+chain_len)))
-                    b = divmod(low_addr, 256)
-                    bin[1] = b[0]   # msb of low_addr
-                    bin[2] = b[1]   # lsb of low_addr
-                    bin[3] = 0          # rectype
-                    try:    # if there is small holes we'll catch them
-                        for i in range_g(chain_len):
-                            bin[4+i] = self._buf[cur_addr+i]
-                    except KeyError:
-                        # we catch a hole so we should shrink the chain
-                        chain_len = i
-                        bin = bin[:5+i]
-                    bin[0] = chain_len
-                    bin[4+chain_len] = (-sum(bin)) & 0x0FF    # chksum
-                    fwrite(':' +
-                           asstr(hexlify(array_tobytes(bin)).translate(table)) +
-                           eol)
-
-                    # adjust cur_addr/cur_ix
-                    cur_ix += chain_len
-                    if cur_ix < addr_len:
-                        cur_addr = addresses[cur_ix]
-                    else:
-                        cur_addr = maxaddr + 1
-                        break
-                    high_addr = int(cur_addr>>16)
-                    if high_addr > high_ofs:
-                        break
+        buf = self._buf
+        if buf:
+            encoder = _HexEncoder(fwrite, eol, byte_count,
+                                  buf.maxaddr() > 65535)
+            for start, data in buf.extents():
+                encoder.write_data(start, data)
 
         # end-of-file record
         fwrite(":00000001FF"+eol)
         if fclose:
             fclose()
 
+    def save_snapshot(self, fobj, checksum=True):
+        """Write snapshot of object to binary file: table of segments,
+        padding, start address and raw data of segments. Snapshot is
+        loaded back with load_snapshot much faster than HEX file.
+
+        Snapshot format (all numbers are little-endian):
+        header (56 bytes): signature 'IHEXSNAP', format version (uint32),
+        flags (uint32, bit 0: checksum is present), padding (uint64),
+        start address: mask of present fields (uint32, bit 0: CS,
+        bit 1: IP, bit 2: EIP) and CS, IP, EIP values (uint32 each),
+        number of segments (uint64), CRC-32 of segment table and data
+        (uint32) and 4 reserved bytes; segment table: start address and
+        length of every segment (uint64 each); data of all segments.
+
+        @param  fobj        file name or file-like object
+                            opened in binary mode
+        @param  checksum    store CRC-32 of data to check it on loading
+        """
+        table = array('Q')
+        for start, stop in self._buf.segments():
+            table.append(start)
+            table.append(stop - start)
+        if sys.byteorder == 'big':
+            table.byteswap()
+        crc = 0
+        flags = 0
+        if checksum:
+            flags |= _SNAPSHOT_CHECKSUM
+            crc = crc32(table.tobytes())
+            for addr, data in self._buf.extents():
+                crc = crc32(data, crc)
+        start_addr = self.start_addr or {}
+        start_mask = 0
+        for bit, key in ((1, 'CS'), (2, 'IP'), (4, 'EIP')):
+            if key in start_addr:
+                start_mask |= bit
+        header = _SNAPSHOT_HEADER.pack(_SNAPSHOT_MAGIC, _SNAPSHOT_VERSION,
+            flags, self.padding, start_mask, start_addr.get('CS', 0),
+            start_addr.get('IP', 0), start_addr.get('EIP', 0),
+            len(table) // 2, crc)
+
+        if getattr(fobj, "write", None) is None:
+            f = open(fobj, "wb")
+        else:
+            f = fobj
+        try:
+            f.write(header)
+            f.write(table.tobytes())
+            for addr, data in self._buf.extents():
+                f.write(data)
+        finally:
+            if f is not fobj:
+                f.close()
+
     def tofile(self, fobj, format, byte_count=16):
         """Write data to hex or bin file. Preferred method over tobin or tohex.
 
@@ -741,41 +1114,85 @@ class IntelHex(object):
         from addr through addr+length, a NotEnoughDataError exception will
         be raised. Padding is not used.
         """
-        a = array('B', asbytes('\0'*length))
-        try:
-            for i in range_g(length):
-                a[i] = self._buf[addr+i]
-        except KeyError:
-            raise NotEnoughDataError(address=addr, length=length)
-        return array_tobytes(a)
+        if length <= 0:
+            return b''
+        # requested bytes should be inside one segment
+        for a, data in self._buf.extents(addr, addr+length):
+            if a == addr and len(data) == length:
+                return data.tobytes()
+            break
+        raise NotEnoughDataError(address=addr, length=length)
 
     def puts(self, addr, s):
         """Put string of bytes at given address. Will overwrite any previous
         entries.
+        @param  addr    start address.
+        @param  s       bytes string or any bytes-like object.
+        @return         number of bytes written.
         """
-        a = array('B', asbytes(s))
-        for i in range_g(len(a)):
-            self._buf[addr+i] = a[i]
+        if isinstance(s, StrType):
+            s = asbytes(s)
+        data = memoryview(s)
+        if data.format != 'B' or not data.contiguous:
+            data = memoryview(data.tobytes())
+        self._buf.write(addr, data)
+        return data.nbytes
 
     def getsz(self, addr):
         """Get zero-terminated bytes string from given address. Will raise 
         NotEnoughDataError exception if a hole is encountered before a 0.
         """
-        i = 0
-        try:
-            while True:
-                if self._buf[addr+i] == 0:
-                    break
-                i += 1
-        except KeyError:
-            raise NotEnoughDataError(msg=('Bad access at 0x%X: '
-                'not enough data to read zero-terminated string') % addr)
-        return self.gets(addr, i)
+        # search in growing blocks of segment, so time depends on length
+        # of string, not on size of segment (or on number of addresses
+        # with storage which builds extents from separate bytes)
+        pos = 0
+        n = 64
+        while True:
+            for a, data in self._buf.extents(addr, addr+pos+n):
+                break
+            else:
+                break
+            if a != addr:
+                break
+            i = data[pos:].tobytes().find(b'\0')
+            if i != -1:
+                return data[:pos+i].tobytes()
+            if len(data) < pos+n:
+                break   # end of segment
+            pos += n
+            n *= 4
+        raise NotEnoughDataError(msg=('Bad access at 0x%X: '
+            'not enough data to read zero-terminated string') % addr)
 
     def putsz(self, addr, s):
         """Put bytes string in object at addr and append terminating zero at end."""
-        self.puts(addr, s)
-        self._buf[addr+len(s)] = 0
+        n = self.puts(addr, s)
+        self._buf[addr+n] = 0
+
+    def _iter_matches(self, patterns, start, end):
+        """Iterate over occurrences of patterns in self[start:end]
+        in one pass over data. Data is searched in place, every
+        occurrence is reported, including overlapping ones.
+
+        @param  patterns    list of non-empty bytes patterns
+        @param  start       start of section to search within (or None)
+        @param  end         end of section to search within (or None)
+        @return             iterator of (address, pattern) tuples
+                            sorted by address.
+        """
+        regex = _search_regex(patterns)
+        by_first = {}
+        for p in sorted(set(patterns), key=len):
+            by_first.setdefault(p[0], []).append(p)
+        for a, data in self._buf.extents(start, end):
+            search = regex.search
+            m = search(data)
+            while m is not None:
+                i = m.start()
+                for p in by_first[data[i]]:
+                    if data[i:i+len(p)] == p:
+                        yield a+i, p
+                m = search(data, i+1)
 
     def find(self, sub, start=None, end=None):
         """Return the lowest index in self[start:end] where subsection sub is found.
@@ -786,13 +1203,80 @@ class IntelHex(object):
         @param  end     end of section to search within (optional)
         """
         sub = bytes(sub)
-        for start, end in self[slice(start,end)].segments():
-            b = self.gets(start, end-start)
-            i = b.find(sub)
-            if i != -1:
-                return start+i
+        if not sub:
+            for a, b in self._buf.segments(start, end):
+                return a
+            return -1
+        for a, p in self._iter_matches([sub], start, end):
+            return a
         return -1
 
+    def rfind(self, sub, start=None, end=None):
+        """Return the highest index in self[start:end] where subsection sub is found.
+        Optional arguments start and end are interpreted as in slice notation.
+        Data is searched backward in growing blocks, so time depends
+        on distance of the match from the end of data.
+
+        @param  sub     bytes-like subsection to find
+        @param  start   start of section to search within (optional)
+        @param  end     end of section to search within (optional)
+        """
+        sub = bytes(sub)
+        extents = list(self._buf.extents(start, end))
+        if not sub:
+            if extents:
+                a, data = extents[-1]
+                return a+len(data)
+            return -1
+        for a, data in reversed(extents):
+            stop = len(data)
+            n = max(256, 2*len(sub))
+            while stop >= len(sub):
+                pos = max(0, stop-n)
+                i = data[pos:stop].tobytes().rfind(sub)
+                if i != -1:
+                    return a+pos+i
+                if pos == 0:
+                    break
+                stop = pos+len(sub)-1
+                n *= 4
+        return -1
+
+    def findall(self, sub, start=None, end=None):
+        """Return list of all indexes in self[start:end] where subsection sub
+        is found, overlapping occurrences included.
+        Optional arguments start and end are interpreted as in slice notation.
+
+        @param  sub     non-empty bytes-like subsection to find
+        @param  start   start of section to search within (optional)
+        @param  end     end of section to search within (optional)
+        """
+        sub = bytes(sub)
+        if not sub:
+            raise ValueError('empty subsection')
+        return [a for a, p in self._iter_matches([sub], start, end)]
+
+    def find_any(self, patterns, start=None, end=None):
+        """Find all occurrences of any of several patterns in self[start:end]
+        with one pass over data. Patterns are combined into one regular
+        expression built from their prefix tree, so the cost of search
+        grows slowly with number of patterns.
+        Optional arguments start and end are interpreted as in slice notation.
+
+        @param  patterns    iterable of non-empty bytes-like patterns
+        @param  start       start of section to search within (optional)
+        @param  end         end of section to search within (optional)
+        @return             list of (address, pattern) tuples sorted
+                            by address; patterns found at the same address
+                            are sorted by length.
+        """
+        patterns = [bytes(p) for p in patterns]
+        if not all(patterns):
+            raise ValueError('empty pattern')
+        if not patterns:
+            return []
+        return list(self._iter_matches(patterns, start, end))
+
     def dump(self, tofile=None, width=16, withpadding=False):
         """Dump object content to specified file object or to stdout if None.
         Format is a hexdump with some header information at the beginning,
@@ -823,11 +1307,9 @@ class IntelHex(object):
             else:
                 tofile.write('start_addr = %r\n' % self.start_addr)
         # actual data
-        addresses = dict_keys(self._buf)
-        if addresses:
-            addresses.sort()
-            minaddr = addresses[0]
-            maxaddr = addresses[-1]
+        if self._buf:
+            minaddr = self._buf.minaddr()
+            maxaddr = self._buf.maxaddr()
             startaddr = (minaddr // width) * width
             endaddr = ((maxaddr // width) + 1) * width
             maxdigits = max(len(hex(endaddr)) - 2, 4)   # Less 2 to exclude '0x'
@@ -868,7 +1350,10 @@ class IntelHex(object):
         @raise  ValueError      if other is the same object as self 
                                 (it can't merge itself)
         @raise  ValueError      if overlap argument has incorrect value
-        @raise  AddressOverlapError    on overlapped data
+        @raise  AddressOverlapError    on overlapped data; ranges attribute
+                                of exception is list of all overlapped
+                                (start, stop) ranges. Current object
+                                is not changed in this case.
         """
         # check args
         if not isinstance(other, IntelHex):
@@ -878,29 +1363,42 @@ class IntelHex(object):
         if overlap not in ('error', 'ignore', 'replace'):
             raise ValueError("overlap argument should be either "
                 "'error', 'ignore' or 'replace'")
-        # merge data
         this_buf = self._buf
-        other_buf = other._buf
-        for i in other_buf:
-            if i in this_buf:
-                if overlap == 'error':
-                    raise AddressOverlapError(
-                        'Data overlapped at address 0x%X' % i)
-                elif overlap == 'ignore':
-                    continue
-            this_buf[i] = other_buf[i]
+        if overlap == 'error':
+            # check everything before changing self
+            ranges = _intersect_segments(this_buf.segments(),
+                                         other._buf.segments())
+            if ranges:
+                raise AddressOverlapError(_overlap_message(ranges),
+                                          ranges=ranges)
+            if (self.start_addr is not None and
+                    other.start_addr is not None and
+                    self.start_addr != other.start_addr):
+                raise AddressOverlapError(
+                    'Starting addresses are different')
+        # merge data
+        for start, data in other._buf.extents():
+            if overlap != 'ignore':
+                this_buf.write(start, data)
+                continue
+            # write only holes of this object
+            addr = start
+            stop = start + len(data)
+            used = [(a, len(d)) for a, d in this_buf.extents(start, stop)]
+            for a, n in used:
+                if a > addr:
+                    this_buf.write(addr, data[addr-start:a-start])
+                addr = a + n
+            if addr < stop:
+                this_buf.write(addr, data[addr-start:])
         # merge start_addr
         if self.start_addr != other.start_addr:
             if self.start_addr is None:     # set start addr from other
                 self.start_addr = other.start_addr
             elif other.start_addr is None:  # keep existing start addr
                 pass
-            else:                           # conflict
-                if overlap == 'error':
-                    raise AddressOverlapError(
-                        'Starting addresses are different')
-                elif overlap == 'replace':
-                    self.start_addr = other.start_addr
+            elif overlap == 'replace':      # conflict
+                self.start_addr = other.start_addr
 
     def segments(self, min_gap=1):
         """Return a list of ordered tuple objects, representing contiguous occupied data addresses.
@@ -908,19 +1406,119 @@ class IntelHex(object):
         The second entry of the tuple is always an integer greater than the first entry.
         @param min_gap      the minimum gap size between data in order to separate the segments
         """
-        addresses = self.addresses()
-        if not addresses:
-            return []
-        elif len(addresses) == 1:
-            return([(addresses[0], addresses[0]+1)])
-        adjacent_differences = [(b - a) for (a, b) in zip(addresses[:-1], addresses[1:])]
-        breaks = [i for (i, x) in enumerate(adjacent_differences) if x > min_gap]
-        endings = [addresses[b] for b in breaks]
-        endings.append(addresses[-1])
-        beginnings = [addresses[b+1] for b in breaks]
-        beginnings.insert(0, addresses[0])
-        return [(a, b+1) for (a, b) in zip(beginnings, endings)]
-        
+        segments = self._buf.segments()
+        if min_gap <= 1 or not segments:
+            return segments
+        # consolidate segments with small gaps in one pass over the index
+        merged = [segments[0]]
+        for start, stop in segments[1:]:
+            if start - merged[-1][1] < min_gap:
+                merged[-1] = (merged[-1][0], stop)
+            else:
+                merged.append((start, stop))
+        return merged
+
+    def fill(self, start=None, end=None, value=None, only_gaps=True):
+        """Fill address range with value. Gaps are filled with blocks
+        of bytes and stored with one write, so range becomes one segment
+        merged with adjacent data.
+
+        @param  start       start address of range (minaddr by default).
+        @param  end         end address of range (inclusive,
+                            maxaddr by default).
+        @param  value       byte value (self.padding by default).
+        @param  only_gaps   fill only addresses without data,
+                            if False overwrite data in range as well.
+
+        @raise  ValueError  if value is not a byte.
+        """
+        if value is None:
+            value = self.padding
+        if not 0 <= value <= 255:
+            raise ValueError("fill: value should be byte; got %r" % (value,))
+        start, end = self._get_start_end(start, end)
+        if not only_gaps:
+            self._buf.write(start, bytes(bytearray((value,))) * (end+1-start))
+        elif self._buf.segments(start, end+1) != [(start, end+1)]:
+            data = bytearray().join(self._iter_bin(start, end, value, None))
+            self._buf.write(start, data)
+
+    def pad_to_alignment(self, page_size, value=None):
+        """Extend data to whole pages: every page with some data in it
+        is filled up with value, so all segments start and end at page
+        boundaries.
+
+        @param  page_size   size of page in bytes.
+        @param  value       byte value (self.padding by default).
+
+        @raise  ValueError  if page_size is not positive or value
+                            is not a byte.
+        """
+        if page_size <= 0:
+            raise ValueError("pad_to_alignment: page_size should be"
+                             " positive; got %r" % (page_size,))
+        pages = []
+        for start, stop in self._buf.segments():
+            start -= start % page_size
+            stop += -stop % page_size
+            if pages and start <= pages[-1][1]:
+                pages[-1] = (pages[-1][0], stop)
+            else:
+                pages.append((start, stop))
+        for start, stop in pages:
+            self.fill(start, stop-1, value)
+
+    def move(self, src_start, src_end, dst, update_start_addr=False):
+        """Move data from address range to new address. Data at new
+        addresses is overwritten, source range becomes empty (except
+        the part overlapped by destination). Extents are moved by their
+        addresses: blocks of data are not copied if they don't touch
+        other data at new place (they are copied on first change then).
+
+        @param  src_start           start address of source range.
+        @param  src_end             end address of source range (inclusive).
+        @param  dst                 new start address of the range.
+        @param  update_start_addr   if start address (EIP or CS:IP) is
+                                    in source range, move it as well.
+
+        @raise  ValueError  if data or start address goes out of
+                            address space.
+        """
+        delta = dst - src_start
+        if update_start_addr and self.start_addr:
+            start_addr = _moved_start_addr(self.start_addr, src_start,
+                                           src_end, delta)
+        else:
+            start_addr = self.start_addr
+        if dst < 0:
+            segments = self._buf.segments(src_start, src_end+1)
+            if segments and segments[0][0] + delta < 0:
+                raise ValueError("move: data goes below address 0")
+        if delta:
+            pieces = list(self._buf.extents(src_start, src_end+1))
+            self._buf.delete(src_start, src_end+1)
+            for addr, data in pieces:
+                self._buf.write(addr + delta, data, copy=False)
+        self.start_addr = start_addr
+
+    def relocate(self, delta, update_start_addr=True):
+        """Shift all data by delta bytes (see move).
+
+        @param  delta               address offset (may be negative).
+        @param  update_start_addr   shift start address (EIP or CS:IP)
+                                    as well.
+
+        @raise  ValueError  if data or start address goes out of
+                            address space.
+        """
+        start_addr = self.start_addr
+        if update_start_addr and start_addr:
+            start_addr = _moved_start_addr(start_addr, 0, None, delta)
+        if self._buf:
+            start = self._buf.minaddr()
+            self.move(start, self._buf.maxaddr(), start + delta)
+        self.start_addr = start_addr
+
     def get_memory_size(self):
         """Returns the approximate memory footprint for data."""
         n = sys.getsizeof(self)
@@ -936,34 +1534,55 @@ class IntelHex(object):
 class IntelHex16bit(IntelHex):
     """Access to data as 16-bit words. Intended to use with Microchip HEX files."""
 
-    def __init__(self, source=None):
+    # format of words: array typecode, byte order and size in bytes
+    _typecode = 'H'
+    _byteorder = 'little'
+    _size = 2
+
+    def __init__(self, source=None, storage=None):
         """Construct class from HEX file
         or from instance of ordinary IntelHex class. If IntelHex object
         is passed as source, the original IntelHex object should not be used
-        again because this class will alter it. This class leaves padding
+        again because this class will alter it (use IntelHex.words
+        to get view of the same data instead). This class leaves padding
         alone unless it was precisely 0xFF. In that instance it is sign
         extended to 0xFFFF.
 
         @param  source  file name of HEX file or file object
                         or instance of ordinary IntelHex class.
                         Will also accept dictionary from todict method.
+        @param  storage storage backend class for data (see IntelHex).
         """
         if isinstance(source, IntelHex):
             # from ihex8
             self.padding = source.padding
             self.start_addr = source.start_addr
             # private members
+            self._storage = source._storage
             self._buf = source._buf
             self._offset = source._offset
         elif isinstance(source, dict):
             raise IntelHexError("IntelHex16bit does not support initialization from dictionary yet.\n"
                                 "Patches are welcome.")
         else:
-            IntelHex.__init__(self, source)
+            IntelHex.__init__(self, source, storage)
 
         if self.padding == 0x0FF:
             self.padding = 0x0FFFF
 
+    def _bad_access(self, addr16):
+        """Return exception for word with some of its bytes not set."""
+        if self._size == 2:
+            return BadAccess16bit(address=addr16)
+        return NotEnoughDataError(address=addr16*self._size,
+                                  length=self._size)
+
+    def _to_native(self, bin):
+        """Convert array of words read from storage to native byte order."""
+        if self._byteorder != sys.byteorder:
+            bin.byteswap()
+        return bin
+
     def __getitem__(self, addr16):
         """Get 16-bit word from address.
         Raise error if only one byte from the pair is set.
@@ -973,61 +1592,57 @@ class IntelHex16bit(IntelHex):
         @return         word if bytes exists in HEX file, or self.padding
                         if no data found.
         """
-        addr1 = addr16 * 2
-        addr2 = addr1 + 1
-        byte1 = self._buf.get(addr1, None)
-        byte2 = self._buf.get(addr2, None)
-
-        if byte1 != None and byte2 != None:
-            return byte1 | (byte2 << 8)     # low endian
-
-        if byte1 == None and byte2 == None:
-            return self.padding
-
-        raise BadAccess16bit(address=addr16)
+        size = self._size
+        addr1 = addr16 * size
+        for a, data in self._buf.extents(addr1, addr1+size):
+            if a == addr1 and len(data) == size:
+                return int.from_bytes(data, self._byteorder)
+            raise self._bad_access(addr16)
+        return self.padding
 
     def __setitem__(self, addr16, word):
         """Sets the address at addr16 to word assuming Little Endian mode.
         """
-        addr_byte = addr16 * 2
-        b = divmod(word, 256)
-        self._buf[addr_byte] = b[1]
-        self._buf[addr_byte+1] = b[0]
+        self._buf.write(addr16 * self._size,
+                        word.to_bytes(self._size, self._byteorder))
 
     def minaddr(self):
         '''Get minimal address of HEX content in 16-bit mode.
 
         @return         minimal address used in this object
         '''
-        aa = dict_keys(self._buf)
-        if aa == []:
+        aa = self._buf.minaddr()
+        if aa is None:
             return 0
         else:
-            return min(aa)>>1
+            return aa // self._size
 
     def maxaddr(self):
         '''Get maximal address of HEX content in 16-bit mode.
 
         @return         maximal address used in this object 
         '''
-        aa = dict_keys(self._buf)
-        if aa == []:
+        aa = self._buf.maxaddr()
+        if aa is None:
             return 0
         else:
-            return max(aa)>>1
+            return aa // self._size
 
     def tobinarray(self, start=None, end=None, size=None):
         '''Convert this object to binary form as array (of 2-bytes word data).
         If start and end unspecified, they will be inferred from the data.
+        Data is converted by whole extents, not word by word.
         @param  start   start address of output data.
         @param  end     end address of output data (inclusive).
         @param  size    size of the block (number of words),
                         used with start or end parameter.
         @return         array of unsigned short (uint16_t) data.
+
+        @raise  BadAccess16bit  if only one byte of some word is set.
         '''
-        bin = array('H')
+        bin = array(self._typecode)
 
-        if self._buf == {} and None in (start, end):
+        if not self._buf and None in (start, end):
             return bin
 
         if size is not None and size <= 0:
@@ -1035,16 +1650,963 @@ class IntelHex16bit(IntelHex):
 
         start, end = self._get_start_end(start, end, size)
 
-        for addr in range_g(start, end+1):
-            bin.append(self[addr])
+        n = self._size
+        pad = self.padding.to_bytes(n, self._byteorder)
+        parts = []
+        addr = start*n
+        for a, data in self._buf.extents(start*n, end*n+n):
+            # extents are maximal runs of data, so a run with unaligned
+            # start or end has part of the word in it and nothing in the rest
+            if a % n:
+                raise self._bad_access(a // n)
+            if len(data) % n:
+                raise self._bad_access((a+len(data)) // n)
+            if a > addr:
+                parts.append(pad * ((a-addr) // n))
+            parts.append(data)
+            addr = a + len(data)
+        if addr < end*n+n:
+            parts.append(pad * ((end*n+n-addr) // n))
+
+        bin.frombytes(b''.join(parts))
+        return self._to_native(bin)
+
+    def getwords(self, addr16, count):
+        '''Get block of words from given address. All words should be set,
+        padding is not used.
+
+        @param  addr16  address of the first word.
+        @param  count   number of words.
+        @return         array of unsigned short (uint16_t) data.
 
-        return bin
+        @raise  NotEnoughDataError  if some bytes of the block are not set.
+        '''
+        bin = array(self._typecode)
+        if count <= 0:
+            return bin
+        n = self._size
+        # requested words should be inside one segment
+        for a, data in self._buf.extents(addr16*n, (addr16+count)*n):
+            if a == addr16*n and len(data) == count*n:
+                bin.frombytes(data)
+                return self._to_native(bin)
+            break
+        raise NotEnoughDataError(address=addr16*n, length=count*n)
+
+    def putwords(self, addr16, words):
+        '''Put block of words at given address. Will overwrite any previous
+        entries.
+
+        @param  addr16  address of the first word.
+        @param  words   array of unsigned short or any iterable of words.
+        '''
+        swap = self._byteorder != sys.byteorder
+        if not (isinstance(words, array) and words.typecode == self._typecode):
+            words = array(self._typecode, words)
+        elif swap:
+            words = array(self._typecode, words)    # don't swap caller's array
+        if swap:
+            words.byteswap()
+        self._buf.write(addr16*self._size, memoryview(words).cast('B'))
 
 
 #/class IntelHex16bit
 
 
-def hex2bin(fin, fout, start=None, end=None, size=None, pad=None):
+class IntelHexWords(IntelHex16bit):
+    """View of data of IntelHex object as 16-bit or 32-bit words
+    (see IntelHex.words). View has no data of its own: it uses storage
+    of IntelHex object, so changes made via view are seen in the object
+    and vice versa. Start address is shared too, padding is kept by view
+    as value of whole word.
+    """
+
+    def __init__(self, source, typecode='H', byteorder='little'):
+        """Construct view of IntelHex object.
+
+        @param  source      IntelHex object.
+        @param  typecode    format of words: 'H' for 16-bit,
+                            'I' for 32-bit (as for array).
+        @param  byteorder   order of bytes in words: 'little' or 'big'.
+
+        @raise  ValueError  on bad typecode or byteorder.
+        """
+        if typecode not in ('H', 'I'):
+            raise ValueError("typecode should be 'H' or 'I'; got %r"
+                             % (typecode,))
+        if byteorder not in ('little', 'big'):
+            raise ValueError("byteorder should be 'little' or 'big'; got %r"
+                             % (byteorder,))
+        self._source = source
+        self._typecode = typecode
+        self._byteorder = byteorder
+        self._size = array(typecode).itemsize
+        # byte padding repeated in all bytes of the word
+        self.padding = int.from_bytes(bytearray([source.padding & 0x0FF]) *
+                                      self._size, 'big')
+
+    def _shared(name, doc=None):
+        """Property which gets and sets attribute of viewed object."""
+        return property(lambda self: getattr(self._source, name),
+                        lambda self, value: setattr(self._source, name, value),
+                        doc=doc)
+
+    _buf = _shared('_buf', 'Storage object of viewed IntelHex object')
+    start_addr = _shared('start_addr', 'Start address of viewed IntelHex object')
+    _storage = _shared('_storage')
+    _offset = _shared('_offset')
+    del _shared
+
+#/class IntelHexWords
+
+
+class _HexDecoder(object):
+    """Decoder of HEX file lines into validated records.
+    Used by IntelHex.loadhex and iter_records.
+
+    Lines are decoded in chunks: all records of the chunk are unhexlified
+    with one call and validated in a tight loop. If something is wrong
+    with the chunk (empty lines, bad records) it is decoded again line
+    by line to report the proper error and line number.
+    """
+
+    def __init__(self):
+        self.offset = 0         # address offset set by 02/04 records
+        self.line = 0           # number of processed lines
+        self.start_addr = False # start address record was found
+        self.eof = False        # EOF record was found
+
+    def iter_chunks(self, fobj, chunk=16384):
+        """Read and decode file by chunks of lines.
+        @param  fobj    file-like object (iterable of lines).
+        @param  chunk   number of lines decoded in bulk.
+        @return         iterator of lists of records (see decode).
+                        If chunk has bad record, records before it
+                        are yielded first and the error is raised
+                        after them, so caller can check them
+                        (e.g. for overlap) in order of lines.
+        """
+        it = iter(fobj)
+        while not self.eof:
+            lines = list(islice(it, chunk))
+            if not lines:
+                break
+            result = []
+            try:
+                records = self.decode(lines, result)
+            except HexReaderError:
+                yield result
+                raise
+            yield records
+
+    def decode(self, lines, result=None):
+        """Decode list of lines. Decoding stops after EOF record.
+        @param  lines   list of lines with HEX records.
+        @param  result  list for records decoded one by one; on error
+                        it has records before the bad one.
+        @return         list of (line, record_type, address, data) tuples.
+                        Address of data record is absolute (02/04 offsets
+                        applied), data is memoryview of record payload.
+        """
+        records = [s.rstrip('\r\n') for s in lines]
+        try:
+            if ''.join(records).count(':') != len(records):
+                raise ValueError
+            bin = unhexlify(''.join([s[1:] for s in records]))
+        except (TypeError, ValueError):
+            bin = None
+        if bin is not None:
+            try:
+                bulk = self._decode_bulk(records, bin)
+            except IndexError:
+                bulk = None     # too short record
+            if bulk is not None:
+                return bulk
+        if result is None:
+            result = []
+        self._decode_lines(records, result)
+        return result
+
+    def _decode_bulk(self, records, bin):
+        """Fast path: validate records from unhexlified chunk.
+        @return     list of records or None if chunk has bad records.
+        """
+        view = memoryview(bin)
+        offset = self.offset
+        start_addr = self.start_addr
+        eof = False
+        line = self.line
+        result = []
+        append = result.append
+        pos = 0
+        for s in records:
+            line += 1
+            record_length = bin[pos]
+            end = pos + 5 + record_length
+            record_type = bin[pos+3]
+            if len(s) != 11 + 2*record_length or record_type > 5:
+                return None
+            # adler32 is much faster than sum() for short slices;
+            # its low word is exactly 1 + sum of bytes while the sum
+            # is less than 65521 (i.e. for records up to 250 data bytes)
+            if record_length <= 250:
+                crc = (adler32(bin[pos:end]) & 0x0FFFF) - 1
+            else:
+                crc = sum(bin[pos:end])
+            if crc & 0x0FF:
+                return None
+            if record_type == 0:
+                append((line, 0, offset + bin[pos+1]*256 + bin[pos+2],
+                        view[pos+4:end-1]))
+                pos = end
+                continue
+            data = view[pos+4:end-1]
+            if bin[pos+1] or bin[pos+2]:
+                return None
+            if record_type == 1:
+                if record_length != 0:
+                    return None
+                append((line, 1, 0, data))
+                eof = True
+                break
+            elif record_type in (2, 4):
+                if record_length != 2:
+                    return None
+                offset = _record_offset(record_type, data)
+            else:
+                if record_length != 4 or start_addr:
+                    return None
+                start_addr = True
+            append((line, record_type, 0, data))
+            pos = end
+        self.offset = offset
+        self.start_addr = start_addr
+        self.eof = eof
+        self.line = line
+        return result
+
+    def _decode_lines(self, records, result):
+        """Slow path: decode records one by one and append them to result.
+        @raise  HexRecordError  (or subclasses) on bad record.
+        """
+        offset = self.offset
+        start_addr = self.start_addr
+        line = self.line
+        for s in records:
+            line += 1
+            if not s:
+                continue    # empty line
+            if s[0] != ':':
+                raise HexRecordError(line=line)
+            try:
+                bin = unhexlify(asbytes(s[1:]))
+            except (TypeError, ValueError):
+                # this might be raised by unhexlify when odd hexascii digits
+                raise HexRecordError(line=line)
+            length = len(bin)
+            if length < 5:
+                raise HexRecordError(line=line)
+
+            record_length = bin[0]
+            if length != (5 + record_length):
+                raise RecordLengthError(line=line)
+
+            addr = bin[1]*256 + bin[2]
+
+            record_type = bin[3]
+            if not (0 <= record_type <= 5):
+                raise RecordTypeError(line=line)
+
+            crc = sum(bin)
+            crc &= 0x0FF
+            if crc != 0:
+                raise RecordChecksumError(line=line)
+
+            data = memoryview(bin)[4:4+record_length]
+
+            if record_type == 0:
+                # data record
+                addr += offset
+
+            elif record_type == 1:
+                # end of file record
+                if record_length != 0:
+                    raise EOFRecordError(line=line)
+                result.append((line, record_type, addr, data))
+                self.eof = True
+                break
+
+            elif record_type == 2:
+                # Extended 8086 Segment Record
+                if record_length != 2 or addr != 0:
+                    raise ExtendedSegmentAddressRecordError(line=line)
+                offset = _record_offset(record_type, data)
+
+            elif record_type == 4:
+                # Extended Linear Address Record
+                if record_length != 2 or addr != 0:
+                    raise ExtendedLinearAddressRecordError(line=line)
+                offset = _record_offset(record_type, data)
+
+            elif record_type == 3:
+                # Start Segment Address Record
+                if record_length != 4 or addr != 0:
+                    raise StartSegmentAddressRecordError(line=line)
+                if start_addr:
+                    raise DuplicateStartAddressRecordError(line=line)
+                start_addr = True
+
+            elif record_type == 5:
+                # Start Linear Address Record
+                if record_length != 4 or addr != 0:
+                    raise StartLinearAddressRecordError(line=line)
+                if start_addr:
+                    raise DuplicateStartAddressRecordError(line=line)
+                start_addr = True
+
+            result.append((line, record_type, addr, data))
+        self.offset = offset
+        self.start_addr = start_addr
+        self.line = line
+
+#/class _HexDecoder
+
+
+class _HexEncoder(object):
+    """Encoder of data blocks into HEX records.
+    Used by IntelHex.write_hex_file and bin2hex.
+
+    Records are produced for every block separately: they never cross
+    the end of block or 64K boundary of address space, so big block
+    can be passed in parts split at 64K boundaries.
+    """
+
+    # Translation table for uppercasing hex ascii string.
+    # timeit shows that using hexstr.translate(table)
+    # is faster than hexstr.upper():
+    # 0.452ms vs. 0.652ms (translate vs. upper)
+    if sys.version_info[0] >= 3:
+        # Python 3
+        table = bytes(range_l(256)).upper()
+    else:
+        # Python 2
+        table = ''.join(chr(i).upper() for i in range_g(256))
+
+    def __init__(self, fwrite, eol, byte_count=16, need_offset_record=True):
+        """
+        @param  fwrite              write method of output text file.
+        @param  eol                 line ending.
+        @param  byte_count          number of bytes in the data field.
+        @param  need_offset_record  write 04 records (if data goes above 64K).
+        """
+        self.fwrite = fwrite
+        self.eol = eol
+        self.byte_count = byte_count
+        self.need_offset_record = need_offset_record
+        self.high_ofs = None    # offset of last 04 record
+        # checksum of full data record from the sum of its
+        # address, type and data bytes (record length is added here)
+        self.checksum_table = bytes([(-(i + byte_count)) & 0x0FF
+                                     for i in range_g(256)])
+
+    def _record(self, addr, record_type, data):
+        """Return one record as line of text.
+        @param  addr        16-bit address field.
+        @param  record_type type of record.
+        @param  data        bytes-like object with record data.
+        """
+        bin = bytearray(4)
+        bin[0] = len(data)          # reclen
+        bin[1] = addr >> 8          # msb of addr
+        bin[2] = addr & 0x0FF       # lsb of addr
+        bin[3] = record_type        # rectype
+        bin += data
+        bin.append((-sum(bin)) & 0x0FF)     # chksum
+        return ':' + asstr(hexlify(bin).translate(self.table)) + self.eol
+
+    def _records(self, low_addr, data):
+        """Return data records for block inside one 64K page
+        as one string.
+
+        All full records of the block are built at once: the record
+        fields are filled column by column with extended slices and
+        checksums are computed for all records together as sum of big
+        integers with 16-bit lanes (one lane per record). Only the last
+        short record (if any) is built alone.
+
+        @param  low_addr    16-bit address of the first byte.
+        @param  data        bytes-like object, block of data.
+        """
+        byte_count = self.byte_count
+        count = len(data) // byte_count     # number of full records
+        size = count * byte_count
+        result = ''
+        if count:
+            rec = byte_count + 5
+            bin = bytearray(rec * count)
+            bin[0::rec] = bytes([byte_count]) * count
+            addrs = array('H', range_g(low_addr, low_addr+size, byte_count))
+            if sys.byteorder == 'little':
+                addrs.byteswap()
+            addrs = array_tobytes(addrs)
+            bin[1::rec] = addrs[0::2]   # msb of addr
+            bin[2::rec] = addrs[1::2]   # lsb of addr
+            body = bytes(data[:size])
+            for i in range_g(byte_count):
+                bin[4+i::rec] = body[i::byte_count]
+            # every lane sum fits 16 bits: 2*255 + 255*255 = 65535
+            lane = bytearray(2 * count)
+            total = 0
+            for i in range_g(1, rec-1):
+                lane[0::2] = bin[i::rec]
+                total += int.from_bytes(lane, 'little')
+            sums = total.to_bytes(2 * count, 'little')[0::2]
+            bin[rec-1::rec] = sums.translate(self.checksum_table)
+            hexstr = hexlify(bin).translate(self.table)
+            width = 2 * rec
+            sep = asbytes(self.eol + ':')
+            result = asstr(b':' +
+                           sep.join([hexstr[i:i+width]
+                                     for i in range_g(0, len(hexstr), width)]) +
+                           asbytes(self.eol))
+        if size < len(data):
+            result += self._record(low_addr + size, 0, data[size:])
+        return result
+
+    def write_data(self, start, data):
+        """Write data records for block of bytes.
+        @param  start   address of first byte.
+        @param  data    bytes-like object.
+        """
+        cur_addr = start
+        stop_addr = start + len(data)
+        while cur_addr < stop_addr:
+            high_ofs = cur_addr >> 16
+            if self.need_offset_record and high_ofs != self.high_ofs:
+                self.high_ofs = high_ofs
+                self.fwrite(self._record(0, 4, bytes([high_ofs >> 8,
+                                                      high_ofs & 0x0FF])))
+            # records never cross the end of block or 64K boundary
+            page_end = min(stop_addr, (high_ofs + 1) << 16)
+            self.fwrite(self._records(cur_addr & 0x0FFFF,
+                                      data[cur_addr-start:page_end-start]))
+            cur_addr = page_end
+#/class _HexEncoder
+
+
+def _record_offset(record_type, data):
+    """Return address offset from payload of 02 or 04 record."""
+    if record_type == 2:
+        # Extended 8086 Segment Record
+        return (data[0]*256 + data[1]) * 16
+    # Extended Linear Address Record
+    return (data[0]*256 + data[1]) * 65536
+
+
+def _record_start_addr(record_type, data):
+    """Return start_addr dict from payload of 03 or 05 record."""
+    if record_type == 3:
+        # Start Segment Address Record
+        return {'CS': data[0]*256 + data[1],
+                'IP': data[2]*256 + data[3],
+               }
+    # Start Linear Address Record
+    return {'EIP': (data[0]*16777216 +
+                    data[1]*65536 +
+                    data[2]*256 +
+                    data[3]),
+           }
+
+
+def iter_records(fobj):
+    """Iterate over records of HEX file without loading all data
+    into IntelHex object. File is read and decoded in chunks,
+    so memory usage does not depend on file size.
+    Records are validated in the same way as by IntelHex.loadhex
+    except the check for data overlap.
+
+    @param  fobj    file name or file-like object
+    @return         iterator of (record_type, address, data) tuples:
+                    record_type is int 0..5, address is absolute address
+                    of data record (after applying 02/04 offsets) or
+                    address field of other records, data is memoryview
+                    of record payload.
+
+    @raise  HexRecordError  (or its subclasses) on invalid record.
+    """
+    if getattr(fobj, "read", None) is None:
+        fobj = open(fobj, "r")
+        fclose = fobj.close
+    else:
+        fclose = None
+    try:
+        for records in _HexDecoder().iter_chunks(fobj):
+            for line, record_type, addr, data in records:
+                yield record_type, addr, data
+    finally:
+        if fclose:
+            fclose()
+#/def iter_records
+
+
+# line start of any record except data record (type 00)
+_NOT_DATA_RECORD = re.compile(br'\n(?!:[0-9A-Fa-f]{6}00)')
+
+
+def _progression16(first, step, n):
+    """Return number which hex digits are n 16-bit values first,
+    first+step, first+2*step... (i.e. address fields of n contiguous
+    data records) written one after another.
+    """
+    x = 0x10000
+    p = 1 << (16*n)
+    ones = (p - 1) // (x - 1)                               # sum of x**j
+    weighted = (x - n*p + (n-1)*p*x) // ((x - 1) * (x - 1)) # sum of j*x**j
+    return first*ones + step*((n-1)*ones - weighted)
+
+
+class _HexIndexer(object):
+    """Quick scan of HEX file for lazy loading.
+
+    Finds address ranges and file positions of runs of contiguous data
+    records without decoding them: data records are located with one
+    regular expression search per block of file, and sections of records
+    with the same length are checked as a whole by comparing their
+    address fields with arithmetic progression. Other records are decoded
+    and validated as usual.
+    Used by IntelHex.loadhex with lazy=True.
+    """
+
+    BLOCK = 0x400000    # size of block read from file
+
+    def __init__(self):
+        self.runs = []          # [start, stop, pos, end, line, offset] lists
+        self.offset = 0         # address offset set by 02/04 records
+        self.line = 0           # number of processed lines
+        self.start_addr = None  # start address from 03/05 record
+        self.eof = False        # EOF record was found
+        self.indexed = True     # False if file should be decoded as usual
+        self._decoder = _HexDecoder()
+
+    VERSION = 1         # version of saved index format
+    KEY_BLOCK = 0x10000 # size of blocks at both ends of file used in key
+
+    @classmethod
+    def key(cls, fobj, stamp):
+        """Return key of file for its saved index: hash of
+        size, modification time and data at the beginning and
+        the end of the file.
+        @param  fobj    file object opened in binary mode.
+        @param  stamp   result of _file_stamp for the file.
+        """
+        h = hashlib.sha1(asbytes(repr(stamp)))
+        fobj.seek(0)
+        h.update(fobj.read(cls.KEY_BLOCK))
+        if stamp[0] > cls.KEY_BLOCK:
+            fobj.seek(max(cls.KEY_BLOCK, stamp[0] - cls.KEY_BLOCK))
+            h.update(fobj.read())
+        return h.hexdigest()
+
+    @classmethod
+    def load(cls, path, key):
+        """Load saved index.
+        @return     _HexIndexer object or None if there is no valid index
+                    with given key.
+        """
+        try:
+            f = open(path, 'r')
+            try:
+                saved = json.load(f)
+            finally:
+                f.close()
+            if saved['version'] != cls.VERSION or saved['key'] != key:
+                return None
+            indexer = cls()
+            indexer.runs = saved['runs']
+            indexer.offset = saved['offset']
+            indexer.start_addr = saved['start_addr']
+            indexer.indexed = saved['indexed']
+        except (EnvironmentError, ValueError, KeyError, TypeError):
+            return None     # no index or bad index
+        return indexer
+
+    def save(self, path, key):
+        """Save index. File is replaced atomically, so other processes
+        never see partial index. Errors are ignored: index is a cache.
+        """
+        saved = {'version': self.VERSION,
+                 'key': key,
+                 'indexed': self.indexed,
+                 'runs': self.indexed and self.runs or [],
+                 'offset': self.offset,
+                 'start_addr': self.start_addr,
+                }
+        tmp = '%s.%d.tmp' % (path, os.getpid())
+        try:
+            dirname = os.path.dirname(path)
+            if dirname and not os.path.isdir(dirname):
+                os.makedirs(dirname)
+            f = open(tmp, 'w')
+            try:
+                json.dump(saved, f, separators=(',', ':'))
+            finally:
+                f.close()
+            os.replace(tmp, path)
+        except EnvironmentError:
+            try:
+                os.remove(tmp)
+            except EnvironmentError:
+                pass
+
+    def scan(self, fobj):
+        """Scan file.
+        @param  fobj    file object opened in binary mode.
+        @return         False if file can't be indexed and should be
+                        decoded as usual.
+        """
+        rest = b''
+        pos = 0
+        while not self.eof:
+            data = fobj.read(self.BLOCK)
+            block = rest + data
+            if data:
+                k = block.rfind(b'\n') + 1
+                if not k:
+                    return False    # too long line
+                rest = block[k:]
+                block = block[:k]
+            if not block:
+                break
+            if (b'\r' in block and
+                    block.count(b'\r') != block.count(b'\r\n')):
+                return False        # old Mac line endings
+            if not self._scan_block(block, pos):
+                return False
+            pos += len(block)
+            if not data:
+                break
+        # overlapped data is reported by full decoding
+        runs = sorted(self.runs)
+        for i in range_g(1, len(runs)):
+            if runs[i][0] < runs[i-1][1]:
+                return False
+        return True
+
+    def _scan_block(self, block, pos):
+        """Scan block of complete lines starting at file position pos."""
+        start = 0
+        for m in _NOT_DATA_RECORD.finditer(b'\n' + block):
+            p = m.start()   # start of line in block
+            if p >= len(block):
+                break
+            if p > start and not self._scan_data(block, start, p, pos):
+                return False
+            end = block.find(b'\n', p) + 1 or len(block)
+            decoder = self._decoder
+            decoder.line = self.line
+            decoder.offset = self.offset
+            decoder.start_addr = self.start_addr is not None
+            for line, record_type, addr, data in decoder.decode(
+                    [block[p:end].decode('latin-1')]):
+                if record_type == 0:
+                    return False
+                elif record_type == 1:
+                    self.eof = True
+                    return True
+                elif record_type in (2, 4):
+                    self.offset = decoder.offset
+                else:
+                    self.start_addr = _record_start_addr(record_type, data)
+            self.line += 1
+            start = end
+        if start < len(block):
+            return self._scan_data(block, start, len(block), pos)
+        return True
+
+    def _scan_data(self, block, start, end, pos):
+        """Scan section of block with data records only."""
+        sec = block[start:end]
+        n = len(sec)
+        size = sec.find(b'\n') + 1      # length of line
+        if size and not n % size:
+            n //= size
+            eol = 1 + (sec[size-2:size-1] == b'\r')
+            length, odd = divmod(size - 11 - eol, 2)
+            if (not odd and length > 0 and
+                    sec.count(b'\n') == n and sec[size-1::size] == b'\n'*n and
+                    (sec.count(b'\r') == n if eol == 2
+                     else b'\r' not in sec)):
+                # all records have the same length,
+                # check that they are contiguous
+                first = int(sec[3:7], 16)
+                if first + (n-1)*length <= 0x0FFFF:
+                    digits = bytearray(4*n)
+                    for i in range_g(4):
+                        digits[i::4] = sec[3+i::size]
+                    try:
+                        found = int(digits, 16)
+                    except ValueError:
+                        return False
+                    if found == _progression16(first, length, n):
+                        self._add_run(first, first + n*length,
+                                      pos+start, pos+end, self.line+1)
+                        self.line += n
+                        return True
+        # different records: read address and length of each one
+        p = start
+        while p < end:
+            e = block.find(b'\n', p, end) + 1 or end
+            try:
+                header = int(block[p+1:p+9], 16)
+            except ValueError:
+                return False
+            addr = (header >> 8) & 0x0FFFF
+            self.line += 1
+            self._add_run(addr, addr + (header >> 24), pos+p, pos+e,
+                          self.line)
+            p = e
+        return True
+
+    def _add_run(self, start, stop, pos, end, line):
+        """Add data records at file positions [pos, end) with data
+        for addresses [start, stop) (relative to current offset)."""
+        if start == stop:
+            return
+        offset = self.offset
+        runs = self.runs
+        if runs:
+            last = runs[-1]
+            if (last[1] == offset + start and last[3] == pos and
+                    last[5] == offset):
+                last[1] = offset + stop
+                last[3] = end
+                return
+        runs.append([offset + start, offset + stop, pos, end, line, offset])
+
+#/class _HexIndexer
+
+
+_CRC16_TABLES = {}
+
+def _crc16_table(poly):
+    """Return (cached) table for MSB first CRC-16 with given polynomial."""
+    table = _CRC16_TABLES.get(poly)
+    if table is None:
+        table = []
+        for i in range(256):
+            crc = i << 8
+            for _ in range(8):
+                if crc & 0x8000:
+                    crc = ((crc << 1) ^ poly) & 0x0FFFF
+                else:
+                    crc = (crc << 1) & 0x0FFFF
+            table.append(crc)
+        table = _CRC16_TABLES[poly] = tuple(table)
+    return table
+
+
+def _moved_start_addr(start_addr, start, end, delta):
+    """Return start address dict shifted by delta if address is
+    in range [start, end] (end None means no upper limit).
+    @raise  ValueError  if new address does not fit into record.
+    """
+    if 'EIP' in start_addr:
+        addr = start_addr['EIP']
+    else:
+        addr = start_addr['CS']*16 + start_addr['IP']
+    if addr < start or (end is not None and addr > end):
+        return start_addr
+    if 'EIP' in start_addr:
+        if not 0 <= addr + delta <= 0x0FFFFFFFF:
+            raise ValueError("start address 0x%X is out of range"
+                             % (addr + delta))
+        return {'EIP': addr + delta}
+    cs, ip = start_addr['CS'], start_addr['IP']
+    if delta % 16:
+        # CS can be moved only by whole paragraphs, normalize CS:IP
+        cs, ip = divmod(addr + delta, 16)
+    else:
+        cs += delta // 16
+    if not 0 <= cs <= 0x0FFFF or addr + delta < 0:
+        raise ValueError("start address 0x%X is out of range"
+                         % (addr + delta))
+    return {'CS': cs, 'IP': ip}
+
+
+def _file_stamp(fobj):
+    """Return (size, mtime) of file to detect its changes."""
+    st = os.fstat(fobj.fileno())
+    return st.st_size, st.st_mtime
+
+
+def _load_hex_run(fname, stamp, run):
+    """Decode run of data records found by _HexIndexer.
+
+    @param  fname   name of HEX file.
+    @param  stamp   result of _file_stamp for the file when it was indexed.
+    @param  run     (start, stop, pos, end, line, offset) tuple.
+    @return         list with one (address, data) block.
+
+    @raise  HexRecordError  (or its subclasses) on invalid record.
+    @raise  HexReaderError  if file was changed after indexing.
+    """
+    start, stop, pos, end, line, offset = run
+    changed = HexReaderError(
+        msg='Hex file %s was changed after loading' % fname)
+    f = open(fname, 'rb')
+    try:
+        if _file_stamp(f) != stamp:
+            raise changed
+        f.seek(pos)
+        lines = f.read(end - pos).decode('latin-1').split('\n')
+    finally:
+        f.close()
+    if not lines[-1]:
+        del lines[-1]
+    decoder = _HexDecoder()
+    decoder.offset = offset
+    decoder.line = line - 1
+    decoder.start_addr = True
+    addr = start
+    data = []
+    for line, record_type, record_addr, payload in decoder.decode(lines):
+        if record_type != 0 or record_addr != addr:
+            raise changed
+        data.append(payload)
+        addr += len(payload)
+    if addr != stop:
+        raise changed
+    return [(start, b''.join(data))]
+
+
+def _tell(fobj):
+    """Return current position of file object or None if it's not seekable."""
+    try:
+        return fobj.tell()
+    except (AttributeError, IOError, OSError, ValueError):
+        return None
+
+
+def _write_pad(fobj, pad, n):
+    """Write n padding bytes to file in big blocks."""
+    for block in _pad_blocks(pad, n):
+        fobj.write(block)
+
+
+def _pad_blocks(pad, n):
+    """Iterate over blocks of padding bytes, n bytes in total."""
+    block = bytes(bytearray((pad,))) * min(n, 65536)
+    while n > len(block):
+        yield block
+        n -= len(block)
+    if n > 0:
+        yield block[:n]
+
+
+def _hex2bin_stream(fin, fout, start, end, size, pad):
+    """Convert hex to bin writing data to output as records are read,
+    without loading the whole hex file into memory.
+    Works while data records come in ascending address order.
+    Arguments are the same as for hex2bin, but input should be
+    file object.
+
+    Output file given by name is written to temporary file which
+    replaces it only after successful conversion. Output file object
+    is used only if it's positioned at its end, so nothing is lost
+    when output is truncated back after error.
+
+    @return     True if conversion is done;
+                False if output depends on data in a way that needs
+                the whole file (records out of order, no data in range)
+                or files can't be used for streaming. Input and output
+                are rewound to their initial positions then, so buffered
+                conversion can be done instead.
+    """
+    fin_pos = _tell(fin)
+    if fin_pos is None:
+        return False
+    if getattr(fout, "write", None) is None:
+        fout_pos = None
+        fout_obj = None
+        tmp = '%s.%d.tmp' % (fout, os.getpid())
+    else:
+        fout_pos = _tell(fout)
+        try:
+            at_end = fout_pos is not None and fout.seek(0, 2) == fout_pos
+        except (IOError, OSError, ValueError):
+            at_end = False
+        if not at_end:
+            if fout_pos is not None:
+                fout.seek(fout_pos)
+            fin.seek(fin_pos)
+            return False
+        fout_obj = fout
+
+    if pad is None:
+        pad = 0x0FF
+    # the same address range rules as in hex2bin/tobinfile,
+    # but minimal address is known only after first data record
+    lo = start
+    hi = end
+    if size:
+        if end is None:
+            if start is not None:
+                hi = start + size - 1
+        else:
+            lo = max(end + 1 - size, 0)
+    elif None not in (lo, hi) and lo > hi:
+        lo, hi = hi, lo
+
+    done = False
+    try:
+        if fout_obj is None:
+            fout_obj = open(tmp, "wb")
+        pos = lo            # next address to write
+        prev_end = -1       # end of previous data record
+        written = False
+        for record_type, addr, data in iter_records(fin):
+            if record_type != 0 or not data:
+                continue
+            if addr < prev_end:
+                return False    # out of order
+            prev_end = addr + len(data)
+            if lo is None:
+                lo = pos = addr
+                if size:
+                    hi = lo + size - 1
+            s = max(addr, lo)
+            e = prev_end
+            if hi is not None:
+                e = min(e, hi + 1)
+            if s < e:
+                if s > pos:
+                    _write_pad(fout_obj, pad, s - pos)
+                fout_obj.write(data[s-addr:e-addr])
+                pos = e
+                written = True
+        if not written:
+            return False
+        if hi is not None and pos <= hi:
+            _write_pad(fout_obj, pad, hi + 1 - pos)
+        done = True
+        return True
+    finally:
+        if not done:
+            fin.seek(fin_pos)
+        if fout_pos is None:
+            if fout_obj is not None:
+                fout_obj.close()
+                if done:
+                    os.replace(tmp, fout)
+                else:
+                    os.remove(tmp)
+        elif not done:
+            fout.seek(fout_pos)
+            fout.truncate()
+
+
+def hex2bin(fin, fout, start=None, end=None, size=None, pad=None,
+            stream=False):
     """Hex-to-Bin convertor engine.
     @return     0   if all OK
 
@@ -1054,7 +2616,35 @@ def hex2bin(fin, fout, start=None, end=None, size=None, pad=None):
     @param  end     end of address range (inclusive; optional)
     @param  size    size of resulting file (in bytes) (optional)
     @param  pad     padding byte (optional)
+    @param  stream  write output while reading input, without loading
+                    whole hex file into memory. Used when data records
+                    are in ascending address order and both input and
+                    output are file names or seekable files, otherwise
+                    conversion falls back to loading whole hex file.
     """
+    if stream and getattr(fin, "read", None) is None:
+        # errors of input file are not reported as errors of output
+        fin = open(fin, "r")
+        try:
+            return hex2bin(fin, fout, start, end, size, pad, stream)
+        finally:
+            fin.close()
+
+    if stream:
+        try:
+            if _hex2bin_stream(fin, fout, start, end, size, pad):
+                return 0
+        except HexReaderError:
+            e = sys.exc_info()[1]     # current exception
+            txt = "ERROR: bad HEX file: %s" % str(e)
+            print(txt)
+            return 1
+        except IOError:
+            e = sys.exc_info()[1]     # current exception
+            txt = "ERROR: Could not write to file: %s: %s" % (fout, str(e))
+            print(txt)
+            return 1
+
     try:
         h = IntelHex(fin)
     except HexReaderError:
@@ -1090,35 +2680,413 @@ def hex2bin(fin, fout, start=None, end=None, size=None, pad=None):
 #/def hex2bin
 
 
+_SNAPSHOT_MAGIC = b'IHEXSNAP'
+_SNAPSHOT_VERSION = 1
+_SNAPSHOT_CHECKSUM = 1      # flag: CRC-32 of data is present
+_SNAPSHOT_HEADER = struct.Struct('<8sIIQIIIIQI4x')
+
+
+def _read_exactly(fobj, n):
+    """Read n bytes from file (pipe can return less than asked).
+    @return     bytes, shorter than n only at the end of file.
+    """
+    data = fobj.read(n)
+    while len(data) < n:
+        more = fobj.read(n - len(data))
+        if not more:
+            break
+        data += more
+    return data
+
+
+def _read_into(fobj, buf):
+    """Fill buffer from file with readinto.
+    @return     number of bytes read (less than size of buffer only
+                at the end of file).
+    """
+    view = memoryview(buf)
+    pos = 0
+    while pos < len(view):
+        n = fobj.readinto(view[pos:])
+        if not n:
+            break
+        pos += n
+    return pos
+
+
+def _map_file(fobj, write=False):
+    """Map whole file into memory with mmap.
+
+    @param  fobj    file name or file object positioned at start of file.
+    @param  write   if True changes of mapped data are written to file,
+                    otherwise they are private (copy-on-write).
+    @return         writable memoryview of mapped file or None if file
+                    can't be mapped (not a real file, empty file).
+    """
+    if getattr(fobj, "read", None) is None:
+        f = open(fobj, write and "r+b" or "rb")
+    else:
+        f = fobj
+        if _tell(f) not in (0, None):
+            return None
+    try:
+        import mmap
+        access = write and mmap.ACCESS_WRITE or mmap.ACCESS_COPY
+        m = mmap.mmap(f.fileno(), 0, access=access)
+    except (AttributeError, EnvironmentError, ImportError, ValueError):
+        return None     # not a real file, empty file or pipe
+    finally:
+        if f is not fobj:
+            f.close()   # mapping stays valid after closing the file
+    return memoryview(m)
+
+
+def _iter_bin_chunks(fobj, offset=0, chunk=0x100000):
+    """Read bin file by chunks. Every chunk except the first one starts
+    at 64K boundary of address space, so HEX records produced for chunks
+    are the same as for whole data.
+    Real files are mapped into memory with mmap if possible.
+
+    @param  fobj    file-like object opened in binary mode.
+    @param  offset  address of first byte.
+    @param  chunk   size of chunk (multiple of 64K, at least 128K).
+    @return         iterator of (address, data) pairs.
+    """
+    try:
+        import mmap
+        m = mmap.mmap(fobj.fileno(), 0, access=mmap.ACCESS_READ)
+    except (AttributeError, EnvironmentError, ImportError, ValueError):
+        m = None    # not a real file, empty file or pipe
+    if m is not None and _tell(fobj) == 0:
+        view = memoryview(m)
+        try:
+            pos = 0
+            while pos < len(m):
+                n = chunk - ((offset + pos) & 0x0FFFF)
+                yield offset + pos, view[pos:pos+n]
+                pos += n
+        finally:
+            del view
+            try:
+                m.close()
+            except BufferError:
+                pass    # chunk is still referenced, gc will close mmap
+        return
+    if m is not None:
+        m.close()
+    addr = offset
+    while True:
+        n = chunk - (addr & 0x0FFFF)
+        data = _read_exactly(fobj, n)
+        if not data:
+            return
+        yield addr, data
+        addr += len(data)
+
+
 def bin2hex(fin, fout, offset=0):
     """Simple bin-to-hex convertor.
+    Input file is read and converted by chunks (or mapped into memory
+    with mmap), so memory usage does not depend on its size.
     @return     0   if all OK
 
     @param  fin     input bin file (filename or file-like object)
     @param  fout    output hex file (filename or file-like object)
     @param  offset  starting address offset for loading bin
     """
-    h = IntelHex()
-    try:
-        h.loadbin(fin, offset)
-    except IOError:
-        e = sys.exc_info()[1]     # current exception
-        txt = 'ERROR: unable to load bin file:', str(e)
-        print(txt)
-        return 1
+    if getattr(fin, "read", None) is None:
+        try:
+            fin = open(fin, "rb")
+        except IOError:
+            e = sys.exc_info()[1]     # current exception
+            txt = 'ERROR: unable to load bin file:', str(e)
+            print(txt)
+            return 1
+        fin_close = fin.close
+    else:
+        fin_close = None
 
+    fwrite = None
+    fclose = None
     try:
-        h.tofile(fout, format='hex')
-    except IOError:
-        e = sys.exc_info()[1]     # current exception
-        txt = "ERROR: Could not write to file: %s: %s" % (fout, str(e))
-        print(txt)
-        return 1
+        chunks = _iter_bin_chunks(fin, offset)
+        try:
+            reading = True
+            chunk = next(chunks, None)
+            reading = False
+            fwrite = getattr(fout, "write", None)
+            if fwrite is None:
+                fobj = open(fout, 'w')
+                fwrite = fobj.write
+                fclose = fobj.close
+            if chunk is not None:
+                # 04 records are needed only if data goes above 64K:
+                # first chunk always goes above 64K if it's not the last one
+                encoder = _HexEncoder(fwrite, '\n', 16,
+                                      offset + len(chunk[1]) > 65536)
+                while chunk is not None:
+                    encoder.write_data(*chunk)
+                    reading = True
+                    chunk = next(chunks, None)
+                    reading = False
+            fwrite(":00000001FF\n")
+        except IOError:
+            e = sys.exc_info()[1]     # current exception
+            if reading:
+                txt = 'ERROR: unable to load bin file:', str(e)
+            else:
+                txt = ("ERROR: Could not write to file: %s: %s" %
+                       (fout, str(e)))
+            print(txt)
+            return 1
+        finally:
+            chunk = None
+            chunks.close()
+    finally:
+        if fclose:
+            fclose()
+        if fin_close:
+            fin_close()
 
     return 0
 #/def bin2hex
 
 
+def _intersect_segments(a, b):
+    """Return intersection of two sorted lists of disjoint (start, stop)
+    ranges as sorted list of (start, stop) ranges. Both lists are swept
+    once, so time is proportional to their total length.
+    """
+    result = []
+    i = j = 0
+    while i < len(a) and j < len(b):
+        start = max(a[i][0], b[j][0])
+        stop = min(a[i][1], b[j][1])
+        if start < stop:
+            result.append((start, stop))
+        if a[i][1] < b[j][1]:
+            i += 1
+        else:
+            j += 1
+    return result
+
+
+def _overlap_message(ranges):
+    """Return error message listing overlapped (start, stop) ranges."""
+    if len(ranges) == 1 and ranges[0][1] - ranges[0][0] == 1:
+        return 'Data overlapped at address 0x%X' % ranges[0][0]
+    return 'Data overlapped at addresses ' + ', '.join(
+        ['0x%X' % a if b - a == 1 else '0x%X-0x%X' % (a, b-1)
+         for a, b in ranges])
+
+
+def _search_regex(patterns):
+    """Compile regular expression matching any of non-empty bytes patterns.
+    Patterns are merged into prefix tree first, so at every position
+    regex engine tests each byte once for all patterns sharing a prefix
+    (in the spirit of Aho-Corasick automaton).
+    """
+    patterns = set(patterns)
+    if len(patterns) == 1:
+        return re.compile(re.escape(patterns.pop()))
+    trie = {}
+    for p in patterns:
+        node = trie
+        for c in p:
+            node = node.setdefault(c, {})
+        node[None] = None
+
+    # nodes in pre-order, walked with explicit stack: long patterns
+    # make deep trees
+    order = []
+    stack = [trie]
+    while stack:
+        node = stack.pop()
+        order.append(node)
+        stack.extend(v for k, v in node.items() if k is not None)
+    # build regex of every node after its children; regex is kept as list
+    # of pieces in reverse order to prepend bytes of long chains cheaply
+    parts = {}
+    for node in reversed(order):
+        keys = sorted(k for k in node if k is not None)
+        if not keys:
+            rev = []
+        elif len(keys) == 1:
+            rev = parts.pop(id(node[keys[0]]))
+            rev.append(re.escape(bytes(keys)))
+            if None in node:
+                rev = [b')?'] + rev + [b'(?:']
+        else:
+            rev = [b')?' if None in node else b')']
+            for i, c in enumerate(reversed(keys)):
+                if i:
+                    rev.append(b'|')
+                rev.extend(parts.pop(id(node[c])))
+                rev.append(re.escape(bytes((c,))))
+            rev.append(b'(?:')
+        parts[id(node)] = rev
+    return re.compile(b''.join(reversed(parts[id(trie)])))
+
+
+def _merge_extents(sources, overlap):
+    """Sweep extents of several sources once in address order.
+
+    One pending extent of every source is kept in heap ordered by
+    address and source priority: with 'replace' later sources win,
+    otherwise earlier ones.
+
+    @param  sources     list of iterators of (addr, data) extents,
+                        each sorted by address.
+    @param  overlap     overlap policy ('error', 'ignore' or 'replace').
+    @return             tuple (pieces, ranges, index): pieces is list of
+                        (addr, data, index) blocks of merged data sorted
+                        by address (index is number of source), ranges is sorted list of (start, stop)
+                        ranges where data of sources overlapped, index is
+                        the lowest number of source which has data
+                        overlapped by previous sources (or None).
+    """
+    heap = []
+    for i, it in enumerate(sources):
+        rank = -i if overlap == 'replace' else i
+        for addr, data in it:
+            heap.append((addr, rank, i, data, it))
+            break
+    heapify(heap)
+    pieces = []
+    overlapped = []
+    pos = None      # end of merged data
+    first = None    # lowest number of overlapping source
+    while heap:
+        addr, rank, i, data, it = heap[0]
+        stop = addr + len(data)
+        if pos is not None and addr < pos:
+            # start of extent is already covered by other source
+            overlapped.append((addr, min(stop, pos)))
+            if overlap != 'replace' and (first is None or i < first):
+                # covered source comes after covering one
+                first = i
+            if stop > pos:
+                heapreplace(heap, (pos, rank, i, data[pos-addr:], it))
+                continue
+        else:
+            # extent wins until source with higher priority starts
+            end = stop
+            for item in heap:
+                if item[1] < rank and item[0] < end:
+                    end = item[0]
+            pieces.append((addr, data[:end-addr], i))
+            pos = end
+            if end < stop:
+                heapreplace(heap, (end, rank, i, data[end-addr:], it))
+                continue
+        for addr, data in it:
+            heapreplace(heap, (addr, rank, i, data, it))
+            break
+        else:
+            heappop(heap)
+    ranges = []
+    for start, stop in sorted(overlapped):
+        if ranges and start <= ranges[-1][1]:
+            if stop > ranges[-1][1]:
+                ranges[-1] = (ranges[-1][0], stop)
+        else:
+            ranges.append((start, stop))
+    return pieces, ranges, first
+
+
+def merge_many(sources, overlap='error', ranges=None, fout=None,
+               write_start_addr=True):
+    """Merge several hex files or IntelHex objects into one with single
+    pass over their data. Extents of all sources are swept together
+    in address order, so merged object is built once, not rebuilt after
+    every source as with repeated IntelHex.merge calls.
+
+    @param  sources     list of sources: IntelHex objects, file names
+                        or file-like objects with hex data.
+    @param  overlap     action on overlap of data or starting addr:
+                        - error: raising AddressOverlapError;
+                        - ignore: keep data from first source that
+                                  contains data at overlapped address;
+                        - replace: use data from last source that
+                                   contains data at overlapped address.
+    @param  ranges      optional list of address ranges, one per source:
+                        (start, end) tuple (end is exclusive, both can be
+                        None) or None for all data of source. As with
+                        slicing, start address of source with range
+                        is not used.
+    @param  fout        optional file name or file-like object: merged
+                        data is written to it in HEX format without
+                        copying data of sources.
+    @param  write_start_addr    write start address record to fout
+                                (if there is start address).
+    @return             merged IntelHex object, or None if fout is given.
+
+    @raise  ValueError          if overlap or ranges argument has
+                                incorrect value
+    @raise  AddressOverlapError on overlapped data (ranges attribute
+                                of exception lists all overlapped ranges)
+                                or different start addresses with
+                                overlap='error'. Attribute source of
+                                exception is the number of the first
+                                source which can't be merged with
+                                previous ones. Nothing is written to
+                                fout in this case.
+    """
+    if overlap not in ('error', 'ignore', 'replace'):
+        raise ValueError("overlap argument should be either "
+            "'error', 'ignore' or 'replace'")
+    sources = list(sources)
+    if ranges is None:
+        ranges = [None] * len(sources)
+    elif len(ranges) != len(sources):
+        raise ValueError('ranges should have one item per source')
+    objs = []
+    owned = []
+    for source in sources:
+        if isinstance(source, IntelHex):
+            objs.append(source)
+            owned.append(False)
+        else:
+            objs.append(IntelHex(source))
+            owned.append(True)
+    extents = []
+    start_addrs = []    # (start_addr, number of source)
+    for i, (ih, r) in enumerate(zip(objs, ranges)):
+        if r is None:
+            extents.append(ih._buf.extents())
+            if ih.start_addr is not None:
+                start_addrs.append((ih.start_addr, i))
+        else:
+            extents.append(ih._buf.extents(r[0], r[1]))
+    pieces, overlapped, first = _merge_extents(extents, overlap)
+    start_addr = None
+    if start_addrs:
+        if overlap == 'replace':
+            start_addr = start_addrs[-1][0]
+        else:
+            start_addr = start_addrs[0][0]
+    if overlap == 'error':
+        # report the first source which fails, as repeated merge does
+        for other, i in start_addrs:
+            if other != start_addr:
+                if first is None or i < first:
+                    raise AddressOverlapError(
+                        'Starting addresses are different', source=i)
+                break
+        if overlapped:
+            raise AddressOverlapError(_overlap_message(overlapped),
+                                      ranges=overlapped, source=first)
+    res = IntelHex()
+    for addr, data, i in pieces:
+        # data of objects loaded here is not shared with anybody
+        res._buf.write(addr, data, copy=(fout is None and not owned[i]))
+    res.start_addr = start_addr
+    if fout is None:
+        return res
+    res.write_hex_file(fout, write_start_addr)
+#/def merge_many
+
+
 def diff_dumps(ih1, ih2, tofile=None, name1="a", name2="b", n_context=3):
     """Diff 2 IntelHex objects and produce unified diff output for their
     hex dumps.
@@ -1382,3 +3350,6 @@ class BadAccess16bit(NotEnoughDataError):
 
 class EmptyIntelHexError(IntelHexError):
     _fmt = "Requested operation cannot be executed with empty object"
+
+class SnapshotError(IntelHexError):
+    _fmt = 'Bad snapshot file: %(reason)s'
@@ -60,17 +60,22 @@ Options:
                             Range can be in form 'START:' or ':END'.
     -l, --length=NNNN,
     -s, --size=NNNN         size of output (decimal value).
+    --stream                write output while reading hex file
+                            instead of loading whole file into memory
+                            (for big files with records in ascending
+                            address order).
 '''
 
     pad = None
     start = None
     end = None
     size = None
+    stream = False
 
     try:
         opts, args = getopt.getopt(sys.argv[1:], "hvp:r:l:s:",
                                   ["help", "version", "pad=", "range=",
-                                   "length=", "size="])
+                                   "length=", "size=", "stream"])
 
         for o, a in opts:
             if o in ("-h", "--help"):
@@ -98,6 +103,8 @@ Options:
                     size = int(a, 10)
                 except:
                     raise getopt.GetoptError('Bad size value')
+            elif o == "--stream":
+                stream = True
 
         if start != None and end != None and size != None:
             raise getopt.GetoptError('Cannot specify START:END and SIZE simultaneously')
@@ -129,7 +136,7 @@ Options:
         fout = compat.get_binary_stdout()
 
     from intelhex import hex2bin
-    sys.exit(hex2bin(fin, fout, start, end, size, pad))
+    sys.exit(hex2bin(fin, fout, start, end, size, pad, stream))
 
 if __name__ == '__main__':
     main()
@@ -137,15 +137,15 @@ def main(args=None):
         return 1
 
     import intelhex
-    # TODO: move actual merge code into intelhex package as helper function
-    #       and write couple of tests for it.
-    res = intelhex.IntelHex()
 
     def end_addr_inclusive(addr):
         if addr is not None:
             return addr + 1
         return addr
 
+    sources = []
+    names = []
+    ranges = []
     for f in args:
         try:
             fname, fstart, fend = intelhex._get_file_and_addr_range(f)
@@ -153,24 +153,32 @@ def main(args=None):
             sys.stderr.write('Bad argument: "%s"\n' % f)
             sys.stderr.write(USAGE+"\n")
             return 1
+        names.append(fname)
         if fname == '-':
             fname = sys.stdin
-        ih = intelhex.IntelHex(fname)
+        sources.append(fname)
         if (fstart, fend) != (None, None):
-            ih = ih[fstart:end_addr_inclusive(fend)]
-        try:
-            res.merge(ih, overlap)
-        except intelhex.AddressOverlapError:
-            e = sys.exc_info()[1]     # current exception
-            sys.stderr.write('Merging: '+fname+"\n")
-            sys.stderr.write(str(e)+"\n")
-            return 1
+            ranges.append((fstart, end_addr_inclusive(fend)))
+        else:
+            ranges.append(None)
 
-    if (start, end) != (None, None):
-        res = res[start:end_addr_inclusive(end)]
     if output is None:
         output = sys.stdout
-    res.write_hex_file(output, write_start_addr)
+    try:
+        if (start, end) == (None, None):
+            # merged data is written without building extra copy of it
+            intelhex.merge_many(sources, overlap, ranges, output,
+                                write_start_addr)
+        else:
+            res = intelhex.merge_many(sources, overlap, ranges)
+            res = res[start:end_addr_inclusive(end)]
+            res.write_hex_file(output, write_start_addr)
+    except intelhex.AddressOverlapError:
+        e = sys.exc_info()[1]     # current exception
+        if getattr(e, 'source', None) is not None:
+            sys.stderr.write('Merging: '+names[e.source]+"\n")
+        sys.stderr.write(str(e)+"\n")
+        return 1
     return 0
 
 
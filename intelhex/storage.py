@@ -0,0 +1,790 @@
+# Copyright (c) 2005-2018, Alexander Belchenko
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms,
+# with or without modification, are permitted provided
+# that the following conditions are met:
+#
+# * Redistributions of source code must retain
+#   the above copyright notice, this list of conditions
+#   and the following disclaimer.
+# * Redistributions in binary form must reproduce
+#   the above copyright notice, this list of conditions
+#   and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# * Neither the name of the author nor the names
+#   of its contributors may be used to endorse
+#   or promote products derived from this software
+#   without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING,
+# BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY
+# AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY,
+# OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED
+# AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE,
+# EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+'''Storage backends for IntelHex data.
+
+Every backend behaves like a dict mapping int addresses to byte values
+and additionally provides extent-level methods used by IntelHex
+for bulk operations:
+
+    minaddr(), maxaddr()    lowest and highest occupied addresses
+    extents(start, stop)    iterate over contiguous runs of data
+    segments(start, stop)   list of (start, stop) of contiguous runs
+    write(addr, data)       store a block of bytes at given address
+    delete(start, stop)     remove all data in address range
+    version                 counter changed by every modification
+                            (used to invalidate cached checksums)
+'''
+
+__docformat__ = "javadoc"
+
+from bisect import bisect_left, bisect_right
+import sys
+
+from intelhex.compat import dict_keys
+
+
+class ExtentStorage(object):
+    '''Data storage as sorted list of contiguous extents.
+
+    Each extent is a start address plus a bytearray with data.
+    Extents never overlap and never touch each other: adjacent
+    extents are glued together, so every extent is exactly one
+    segment of contiguous data.
+
+    Bytearray can't be resized while it is exported to memoryview
+    (see IntelHex.tobinview). In this case storage continues with
+    a copy of extent and the view keeps old data.
+
+    Extent can also be a read-only memoryview of caller's buffer
+    stored without copying (see write). Such extent is copied into
+    own bytearray on first modification.
+
+    Writable buffer, e.g. mmap of a file, can be attached as extent
+    (see attach). Bytes inside such extent are changed in place,
+    only changes of its size continue with a copy.
+    '''
+
+    version = 0     # modification counter
+
+    def __init__(self, source=None):
+        '''Constructor.
+        @param  source  optional mapping {addr: byte} or other storage
+                        for initialization.
+        '''
+        self._starts = []   # sorted list of start addresses
+        self._chunks = []   # bytearray with data for every extent
+        if source is not None:
+            self.update(source)
+
+    # dict-like interface
+
+    def get(self, addr, default=None):
+        i = bisect_right(self._starts, addr) - 1
+        if i >= 0:
+            chunk = self._chunks[i]
+            offset = addr - self._starts[i]
+            if offset < len(chunk):
+                return chunk[offset]
+        return default
+
+    def __getitem__(self, addr):
+        i = bisect_right(self._starts, addr) - 1
+        if i >= 0:
+            chunk = self._chunks[i]
+            offset = addr - self._starts[i]
+            if offset < len(chunk):
+                return chunk[offset]
+        raise KeyError(addr)
+
+    def __setitem__(self, addr, byte):
+        self.version += 1
+        starts = self._starts
+        chunks = self._chunks
+        i = bisect_right(starts, addr) - 1
+        if i >= 0:
+            chunk = chunks[i]
+            offset = addr - starts[i]
+            if offset < len(chunk):
+                if isinstance(chunk, memoryview) and chunk.readonly:
+                    chunk = chunks[i] = bytearray(chunk)
+                chunk[offset] = byte
+                return
+            if offset == len(chunk):
+                try:
+                    chunk.append(byte)
+                except (AttributeError, BufferError):
+                    # view or exported bytearray
+                    chunk = chunks[i] = bytearray(chunk)
+                    chunk.append(byte)
+                # glue with next extent if the hole is closed now
+                j = i + 1
+                if j < len(starts) and starts[j] == addr + 1:
+                    chunk += chunks[j]
+                    del starts[j]
+                    del chunks[j]
+                return
+        j = i + 1
+        if j < len(starts) and starts[j] == addr + 1:
+            try:
+                chunks[j].insert(0, byte)
+            except (AttributeError, BufferError):
+                chunks[j] = bytearray((byte,)) + chunks[j]
+            starts[j] = addr
+        else:
+            chunk = bytearray((byte,))
+            starts.insert(j, addr)
+            chunks.insert(j, chunk)
+
+    def __delitem__(self, addr):
+        self.version += 1
+        starts = self._starts
+        chunks = self._chunks
+        i = bisect_right(starts, addr) - 1
+        if i >= 0:
+            chunk = chunks[i]
+            offset = addr - starts[i]
+            size = len(chunk)
+            if offset < size:
+                if size == 1:
+                    del starts[i]
+                    del chunks[i]
+                elif offset == 0:
+                    try:
+                        del chunk[0]
+                    except (BufferError, TypeError):
+                        chunks[i] = chunk[1:]
+                    starts[i] += 1
+                else:
+                    if offset < size - 1:
+                        # split extent in two
+                        starts.insert(i+1, addr+1)
+                        chunks.insert(i+1, chunk[offset+1:])
+                    try:
+                        del chunk[offset:]
+                    except (BufferError, TypeError):
+                        chunks[i] = chunk[:offset]
+                return
+        raise KeyError(addr)
+
+    def __contains__(self, addr):
+        i = bisect_right(self._starts, addr) - 1
+        return i >= 0 and addr - self._starts[i] < len(self._chunks[i])
+
+    def __len__(self):
+        return sum(map(len, self._chunks))
+
+    def __iter__(self):
+        for start, chunk in zip(self._starts, self._chunks):
+            for addr in range(start, start+len(chunk)):
+                yield addr
+
+    def keys(self):
+        return list(self)
+
+    def values(self):
+        r = []
+        for chunk in self._chunks:
+            r.extend(chunk)
+        return r
+
+    def items(self):
+        r = []
+        for start, chunk in zip(self._starts, self._chunks):
+            r.extend(zip(range(start, start+len(chunk)), chunk))
+        return r
+
+    def update(self, source):
+        '''Update storage with data from source (mapping or storage).
+        Contiguous runs of addresses are written as blocks.
+        '''
+        extents = getattr(source, 'extents', None)
+        if extents is not None:
+            for addr, data in extents():
+                self.write(addr, data)
+            return
+        addresses = dict_keys(source)
+        if not addresses:
+            return
+        addresses.sort()
+        start = prev = addresses[0]
+        run = bytearray((source[start],))
+        for addr in addresses[1:]:
+            if addr != prev + 1:
+                self.write(start, run)
+                start = addr
+                run = bytearray()
+            run.append(source[addr])
+            prev = addr
+        self.write(start, run)
+
+    def copy(self):
+        other = self.__class__()
+        other._starts = self._starts[:]
+        # read-only views are shared, they are never modified
+        other._chunks = [chunk if isinstance(chunk, memoryview) and
+                                  chunk.readonly
+                         else bytearray(chunk)
+                         for chunk in self._chunks]
+        return other
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_chunks'] = [bytearray(chunk) for chunk in self._chunks]
+        return state
+
+    def clear(self):
+        self.version += 1
+        del self._starts[:]
+        del self._chunks[:]
+
+    def __eq__(self, other):
+        if isinstance(other, ExtentStorage):
+            return (self._starts == other._starts and
+                    self._chunks == other._chunks)
+        if isinstance(other, dict):
+            return len(other) == len(self) and dict(self.items()) == other
+        return NotImplemented
+
+    def __ne__(self, other):
+        r = self.__eq__(other)
+        if r is NotImplemented:
+            return r
+        return not r
+
+    __hash__ = None
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, dict(self.items()))
+
+    def __sizeof__(self):
+        n = object.__sizeof__(self)
+        n += sys.getsizeof(self._starts) + sys.getsizeof(self._chunks)
+        for start, chunk in zip(self._starts, self._chunks):
+            n += sys.getsizeof(start) + sys.getsizeof(chunk)
+        return n
+
+    # extent-level interface
+
+    def minaddr(self):
+        '''Return lowest occupied address or None if there is no data.'''
+        if self._starts:
+            return self._starts[0]
+        return None
+
+    def maxaddr(self):
+        '''Return highest occupied address or None if there is no data.'''
+        if self._starts:
+            return self._starts[-1] + len(self._chunks[-1]) - 1
+        return None
+
+    def extents(self, start=None, stop=None):
+        '''Iterate over contiguous runs of data in ascending order.
+        Runs are clipped to the address range [start, stop).
+
+        @param  start   first address of range (optional)
+        @param  stop    address after the end of range (optional)
+        @return         iterator of (address, memoryview) pairs.
+                        Views share memory with storage, they should not
+                        be kept while storage is modified.
+        '''
+        if start is not None and stop is not None and stop <= start:
+            return
+        starts = self._starts
+        chunks = self._chunks
+        if start is None:
+            i = 0
+        else:
+            i = max(bisect_right(starts, start) - 1, 0)
+        n = len(starts)
+        while i < n:
+            addr = starts[i]
+            if stop is not None and addr >= stop:
+                break
+            chunk = chunks[i]
+            i += 1
+            end = addr + len(chunk)
+            lo = 0
+            hi = len(chunk)
+            if start is not None and start > addr:
+                if start >= end:
+                    continue
+                lo = start - addr
+            if stop is not None and stop < end:
+                hi = stop - addr
+            if lo or hi != len(chunk):
+                yield addr + lo, memoryview(chunk)[lo:hi]
+            else:
+                yield addr, memoryview(chunk)
+
+    def segments(self, start=None, stop=None):
+        '''Return list of (start, stop) tuples for contiguous runs of data
+        in ascending order. Runs are clipped to the address range
+        [start, stop). Extents are segments already, so it's
+        O(number of segments).
+        '''
+        if start is None and stop is None:
+            return [(addr, addr+len(chunk))
+                    for addr, chunk in zip(self._starts, self._chunks)]
+        return [(addr, addr+len(data))
+                for addr, data in self.extents(start, stop)]
+
+    def write(self, addr, data, copy=True):
+        '''Store block of bytes at given address overwriting old data.
+
+        @param  addr    start address for data.
+        @param  data    bytes-like object.
+        @param  copy    if False and block does not touch other data,
+                        storage keeps read-only view of data instead of
+                        copy. Caller should not change data after that.
+        '''
+        data = memoryview(data)
+        if data.format != 'B' or data.ndim != 1 or not data.c_contiguous:
+            # other formats and shapes are stored as plain bytes
+            if data.c_contiguous:
+                data = data.cast('B')
+            else:
+                data = memoryview(data.tobytes())
+        n = len(data)
+        if not n:
+            return
+        self.version += 1
+        starts = self._starts
+        chunks = self._chunks
+        end = addr + n
+        i = bisect_right(starts, addr) - 1
+        if i >= 0 and starts[i] + len(chunks[i]) >= addr:
+            lo = i
+        else:
+            lo = i + 1
+        hi = bisect_right(starts, end) - 1      # extents touching the block
+        if lo > hi:
+            starts.insert(lo, addr)
+            if copy:
+                chunks.insert(lo, bytearray(data))
+            else:
+                chunks.insert(lo, data.toreadonly())
+            return
+        first = starts[lo]
+        last_chunk = chunks[hi]
+        last_end = starts[hi] + len(last_chunk)
+        if lo == hi and first <= addr and end <= last_end:
+            # data fits into existing extent
+            try:
+                last_chunk[addr-first:end-first] = data
+            except TypeError:
+                # read-only view
+                last_chunk = chunks[hi] = bytearray(last_chunk)
+                last_chunk[addr-first:end-first] = data
+            return
+        if last_end > end:
+            tail = last_chunk[end-starts[hi]:]
+        else:
+            tail = None
+        if first <= addr:
+            chunk = chunks[lo]
+            try:
+                del chunk[addr-first:]
+                chunk += data
+            except (BufferError, TypeError):
+                # view or exported bytearray
+                chunk = bytearray(chunk[:addr-first])
+                chunk += data
+        else:
+            first = addr
+            chunk = bytearray(data)
+        if tail is not None:
+            chunk += tail
+        starts[lo:hi+1] = [first]
+        chunks[lo:hi+1] = [chunk]
+
+    def attach(self, addr, buf):
+        '''Store writable buffer as extent without copying.
+        Changes of bytes inside the extent are made directly in buffer
+        (e.g. go to mapped file), operations which add or remove
+        bytes of the extent continue with a copy of it.
+        Old data in the address range of buffer is replaced.
+
+        @param  addr    start address for data.
+        @param  buf     writable object with buffer protocol (mmap).
+
+        @raise  ValueError  if buffer is read-only or there is data
+                            right before or after its address range
+                            (extent can't be glued with other data
+                            without copying).
+        '''
+        view = memoryview(buf).cast('B')
+        if view.readonly:
+            raise ValueError('buffer should be writable')
+        n = len(view)
+        if not n:
+            return
+        if addr-1 in self or addr+n in self:
+            raise ValueError('buffer touches existing data')
+        self.delete(addr, addr+n)
+        self.version += 1
+        i = bisect_right(self._starts, addr)
+        self._starts.insert(i, addr)
+        self._chunks.insert(i, view)
+
+    def delete(self, start, stop):
+        '''Remove all data in address range [start, stop).'''
+        if start >= stop:
+            return
+        self.version += 1
+        starts = self._starts
+        chunks = self._chunks
+        i = bisect_right(starts, start) - 1
+        if i >= 0 and starts[i] + len(chunks[i]) > start:
+            lo = i
+        else:
+            lo = i + 1
+        hi = bisect_left(starts, stop) - 1      # extents starting before stop
+        if lo > hi:
+            return
+        new_starts = []
+        new_chunks = []
+        if starts[lo] < start:
+            new_starts.append(starts[lo])
+            new_chunks.append(chunks[lo][:start-starts[lo]])
+        last_end = starts[hi] + len(chunks[hi])
+        if last_end > stop:
+            new_starts.append(stop)
+            new_chunks.append(chunks[hi][stop-starts[hi]:])
+        starts[lo:hi+1] = new_starts
+        chunks[lo:hi+1] = new_chunks
+
+#/class ExtentStorage
+
+
+class LazyStorage(ExtentStorage):
+    '''Extent storage with data loaded on demand.
+
+    Storage is created with list of pending regions: address range plus
+    function which returns data of the range. Region is loaded when some
+    operation touches its addresses, operations which need all data
+    (iteration, comparison, pickling) load everything. Lowest and highest
+    addresses and number of bytes are known without loading.
+    '''
+
+    def __init__(self, source=None, regions=()):
+        '''Constructor.
+        @param  source  optional mapping {addr: byte} or other storage
+                        for initialization.
+        @param  regions list of (start, stop, load) tuples for
+                        non-overlapping address ranges [start, stop).
+                        load() returns iterable of (addr, data) blocks
+                        with data of the range.
+        '''
+        regions = sorted(regions, key=lambda r: r[0])
+        self._pending_starts = [r[0] for r in regions]
+        self._pending_stops = [r[1] for r in regions]
+        self._pending_loads = [r[2] for r in regions]
+        ExtentStorage.__init__(self, source)
+
+    def _load(self, start=None, stop=None):
+        '''Load pending regions overlapping address range [start, stop).'''
+        starts = self._pending_starts
+        if not starts:
+            return
+        stops = self._pending_stops
+        loads = self._pending_loads
+        lo = 0 if start is None else bisect_right(stops, start)
+        hi = len(starts) if stop is None else bisect_left(starts, stop)
+        if lo >= hi:
+            return
+        regions = loads[lo:hi]
+        del starts[lo:hi]
+        del stops[lo:hi]
+        del loads[lo:hi]
+        for load in regions:
+            for addr, data in load():
+                ExtentStorage.write(self, addr, data, copy=False)
+
+    def pending(self):
+        '''Return list of (start, stop) address ranges not loaded yet.'''
+        return list(zip(self._pending_starts, self._pending_stops))
+
+    # dict-like interface
+
+    def get(self, addr, default=None):
+        self._load(addr, addr+1)
+        return ExtentStorage.get(self, addr, default)
+
+    def __getitem__(self, addr):
+        self._load(addr, addr+1)
+        return ExtentStorage.__getitem__(self, addr)
+
+    def __setitem__(self, addr, byte):
+        self._load(addr, addr+1)
+        ExtentStorage.__setitem__(self, addr, byte)
+
+    def __delitem__(self, addr):
+        self._load(addr, addr+1)
+        ExtentStorage.__delitem__(self, addr)
+
+    def __contains__(self, addr):
+        self._load(addr, addr+1)
+        return ExtentStorage.__contains__(self, addr)
+
+    def __len__(self):
+        return (ExtentStorage.__len__(self) +
+                sum(self._pending_stops) - sum(self._pending_starts))
+
+    def __iter__(self):
+        self._load()
+        return ExtentStorage.__iter__(self)
+
+    def keys(self):
+        self._load()
+        return ExtentStorage.keys(self)
+
+    def values(self):
+        self._load()
+        return ExtentStorage.values(self)
+
+    def items(self):
+        self._load()
+        return ExtentStorage.items(self)
+
+    def copy(self):
+        # pending regions are shared, loading them does not change them
+        other = ExtentStorage.copy(self)
+        other._pending_starts = self._pending_starts[:]
+        other._pending_stops = self._pending_stops[:]
+        other._pending_loads = self._pending_loads[:]
+        return other
+
+    def __getstate__(self):
+        self._load()
+        return ExtentStorage.__getstate__(self)
+
+    def clear(self):
+        ExtentStorage.clear(self)
+        del self._pending_starts[:]
+        del self._pending_stops[:]
+        del self._pending_loads[:]
+
+    def __eq__(self, other):
+        self._load()
+        if isinstance(other, LazyStorage):
+            other._load()
+        return ExtentStorage.__eq__(self, other)
+
+    __hash__ = None
+
+    def __repr__(self):
+        self._load()
+        return ExtentStorage.__repr__(self)
+
+    # extent-level interface
+
+    def minaddr(self):
+        '''Return lowest occupied address or None if there is no data.'''
+        addr = ExtentStorage.minaddr(self)
+        if self._pending_starts:
+            if addr is None or self._pending_starts[0] < addr:
+                return self._pending_starts[0]
+        return addr
+
+    def maxaddr(self):
+        '''Return highest occupied address or None if there is no data.'''
+        addr = ExtentStorage.maxaddr(self)
+        if self._pending_stops:
+            last = self._pending_stops[-1] - 1
+            if addr is None or last > addr:
+                return last
+        return addr
+
+    def extents(self, start=None, stop=None):
+        self._load(start, stop)
+        return ExtentStorage.extents(self, start, stop)
+
+    def segments(self, start=None, stop=None):
+        self._load(start, stop)
+        return ExtentStorage.segments(self, start, stop)
+
+    def write(self, addr, data, copy=True):
+        self._load(addr, addr+memoryview(data).nbytes)
+        ExtentStorage.write(self, addr, data, copy)
+
+    def attach(self, addr, buf):
+        self._load(addr-1, addr+len(memoryview(buf).cast('B'))+1)
+        ExtentStorage.attach(self, addr, buf)
+
+    def delete(self, start, stop):
+        self._load(start, stop)
+        ExtentStorage.delete(self, start, stop)
+
+#/class LazyStorage
+
+
+class DictStorage(dict):
+    '''Legacy data storage: one dict entry per byte.
+
+    Extent-level methods are emulated by sorting addresses,
+    so this backend is slow for big images. Lowest and highest
+    addresses are maintained on every write and recomputed lazily
+    only when one of them is deleted. List of segments is cached
+    until some address is added or deleted.
+    '''
+
+    _bounds = None      # (min, max) or None if unknown
+    _segments = None    # list of (start, stop) or None if unknown
+    version = 0         # modification counter
+
+
+    def _grow(self, addr):
+        bounds = self._bounds
+        if bounds is not None:
+            lo, hi = bounds
+            if addr < lo:
+                self._bounds = (addr, hi)
+            elif addr > hi:
+                self._bounds = (lo, addr)
+        elif len(self) == 1:
+            self._bounds = (addr, addr)
+
+    def _shrink(self, addr):
+        self.version += 1
+        self._segments = None
+        bounds = self._bounds
+        if bounds is not None and addr in bounds:
+            self._bounds = None
+
+    def __setitem__(self, addr, byte):
+        self.version += 1
+        if self._segments is not None and addr not in self:
+            self._segments = None
+        dict.__setitem__(self, addr, byte)
+        self._grow(addr)
+
+    def __delitem__(self, addr):
+        dict.__delitem__(self, addr)
+        self._shrink(addr)
+
+    def update(self, *args, **kwargs):
+        dict.update(self, *args, **kwargs)
+        self._bounds = None
+        self._segments = None
+        self.version += 1
+
+    def setdefault(self, addr, default=None):
+        if addr not in self:
+            self[addr] = default
+        return self[addr]
+
+    def pop(self, addr, *args):
+        r = dict.pop(self, addr, *args)
+        self._shrink(addr)
+        return r
+
+    def popitem(self):
+        r = dict.popitem(self)
+        self._shrink(r[0])
+        return r
+
+    def clear(self):
+        dict.clear(self)
+        self._bounds = None
+        self._segments = None
+        self.version += 1
+
+    def copy(self):
+        return self.__class__(self)
+
+    def minaddr(self):
+        '''Return lowest occupied address or None if there is no data.'''
+        if not self:
+            return None
+        if self._bounds is None:
+            keys = dict_keys(self)
+            self._bounds = (min(keys), max(keys))
+        return self._bounds[0]
+
+    def maxaddr(self):
+        '''Return highest occupied address or None if there is no data.'''
+        if not self:
+            return None
+        if self._bounds is None:
+            keys = dict_keys(self)
+            self._bounds = (min(keys), max(keys))
+        return self._bounds[1]
+
+    def extents(self, start=None, stop=None):
+        '''Iterate over contiguous runs of data in ascending order.
+        See ExtentStorage.extents.
+        '''
+        if (start is not None and stop is not None and
+                stop - start < len(self)):
+            # small range: probe addresses instead of scanning all keys
+            addresses = [a for a in range(start, stop) if a in self]
+        else:
+            addresses = [a for a in dict_keys(self)
+                         if (start is None or a >= start) and
+                            (stop is None or a < stop)]
+        if not addresses:
+            return
+        addresses.sort()
+        first = prev = addresses[0]
+        run = bytearray((self[first],))
+        for addr in addresses[1:]:
+            if addr != prev + 1:
+                yield first, memoryview(run)
+                first = addr
+                run = bytearray()
+            run.append(self[addr])
+            prev = addr
+        yield first, memoryview(run)
+
+    def segments(self, start=None, stop=None):
+        '''Return list of (start, stop) tuples for contiguous runs of data.
+        See ExtentStorage.segments.
+        '''
+        segments = self._segments
+        if segments is None:
+            segments = []
+            addresses = dict_keys(self)
+            addresses.sort()
+            for addr in addresses:
+                if segments and segments[-1][1] == addr:
+                    segments[-1][1] = addr + 1
+                else:
+                    segments.append([addr, addr + 1])
+            segments = self._segments = [tuple(seg) for seg in segments]
+        if start is None and stop is None:
+            return segments[:]
+        result = []
+        for lo, hi in segments:
+            if start is not None and start > lo:
+                lo = start
+            if stop is not None and stop < hi:
+                hi = stop
+            if lo < hi:
+                result.append((lo, hi))
+        return result
+
+    def write(self, addr, data, copy=True):
+        '''Store block of bytes at given address overwriting old data.
+        Data is always copied (copy parameter is ignored).
+        '''
+        for byte in bytearray(data):
+            self[addr] = byte
+            addr += 1
+
+    def delete(self, start, stop):
+        '''Remove all data in address range [start, stop).'''
+        for addr in [a for a in dict_keys(self) if start <= a < stop]:
+            del self[addr]
+
+#/class DictStorage
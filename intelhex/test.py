@@ -34,12 +34,15 @@
 """Test suite for IntelHex library."""
 
 import array
+import binascii
+import hashlib
 import os
 import shlex
 import subprocess
 import sys
 import tempfile
 import unittest
+import zlib
 
 import intelhex
 from intelhex import (
@@ -59,11 +62,20 @@ from intelhex import (
     DuplicateStartAddressRecordError,
     InvalidStartAddressValueError,
     _EndOfFile,
+    NotEnoughDataError,
     BadAccess16bit,
+    bin2hex,
     hex2bin,
+    merge_many,
     Record,
+    SnapshotError,
     )
 from intelhex import compat
+from intelhex.storage import (
+    DictStorage,
+    ExtentStorage,
+    LazyStorage,
+    )
 from intelhex.compat import (
     BytesIO,
     StringIO,
@@ -513,6 +525,32 @@ class TestIntelHex(TestIntelHexBase):
         s2 = array_tobytes(bin8)
         self.assertEqual(s2, s1, "data not equal\n%s\n\n%s" % (s1, s2))
 
+    def test_tobinstr_gaps(self):
+        ih = IntelHex({1: 1, 2: 2, 0x20005: 5})
+        self.assertEqual(b'\xFF\x01\x02\xFF', ih.tobinstr(0, 3))
+        s = ih.tobinstr()
+        self.assertEqual(0x20005, len(s))
+        self.assertEqual(b'\x01\x02' + b'\xFF'*0x20002 + b'\x05', s)
+
+    def test_tobinview(self):
+        ih = IntelHex({1: 1, 2: 2, 3: 3, 5: 5})
+        v = ih.tobinview(1, 3)
+        self.assertTrue(v.readonly)
+        self.assertEqual(b'\x01\x02\x03', v.tobytes())
+        # view shares memory with object
+        ih[2] = 0x22
+        self.assertEqual(b'\x01\x22\x03', v.tobytes())
+        # object can be resized while view is alive
+        ih[4] = 4
+        del ih[1]
+        ih.puts(3, b'abcd')
+        self.assertEqual(b'\x01\x22\x03', v.tobytes())
+        self.assertEqual(b'\x22abcd', ih.tobinstr())
+        # padded copy
+        v = ih.tobinview(0, 3)
+        self.assertEqual(b'\xFF\xFF\x22a', v.tobytes())
+        self.assertEqual(b'', IntelHex().tobinview().tobytes())
+
     def test_tobinfile_realfile(self):
         ih = IntelHex(self.f)
         tf = tempfile.TemporaryFile(mode='wb')
@@ -725,6 +763,14 @@ class TestIntelHex(TestIntelHexBase):
         ih = IntelHex()
         ih[0:8:2] = range_l(4)
         self.assertEqual({0:0, 2:1, 4:2, 6:3}, ih.todict())
+        # bytes-like objects
+        ih = IntelHex()
+        ih[0:2] = b'\x01\x02'
+        ih[2:] = bytearray(b'\x03\x04')
+        ih[:6] = memoryview(b'\x05\x06')
+        ih[6:10:2] = b'\x07\x08'
+        self.assertEqual({0:1, 1:2, 2:3, 3:4, 4:5, 5:6, 6:7, 8:8},
+                         ih.todict())
         # errors in slice operations
         # ih[1:2] = 'a'
         self.assertRaisesMsg(ValueError,
@@ -747,6 +793,27 @@ class TestIntelHex(TestIntelHexBase):
             'stop address cannot be negative',
             setitem, slice(0,-3,-1), [1,2,3])
 
+    def test__setitem__non_byte_buffer(self):
+        words = array.array('H', [0x0102, 0x0304, 0x0506, 0x0708])
+        raw = words.tobytes()
+        for storage in (None, DictStorage):
+            ih = IntelHex(storage=storage)
+            ih[8] = 0xAA
+            ih[0:8] = memoryview(words)
+            self.assertEqual([(0, 9)], ih.segments())
+            self.assertEqual(raw + b'\xAA', ih.gets(0, 9))
+            ih[10:] = memoryview(words)
+            self.assertEqual(raw, ih.gets(10, 8))
+            self.assertRaises(ValueError, ih.__setitem__, slice(0, 4),
+                              memoryview(words))
+        st = ExtentStorage()
+        st.write(10, b'\xBB')
+        st.write(2, memoryview(words), copy=False)
+        st.write(0, memoryview(words)[::2])
+        self.assertEqual([(0, 11)], st.segments())
+        self.assertEqual(raw[:2] + raw[4:6] + raw[2:] + b'\xBB',
+                         bytes(b for a, b in sorted(st.items())))
+
     def test__delitem__(self):
         ih = IntelHex()
         ih[0] = 1
@@ -779,6 +846,22 @@ class TestIntelHex(TestIntelHexBase):
         ih = ihex(8)
         del ih[::2]
         self.assertEqual({1:1, 3:3, 5:5, 7:7}, ih.todict())
+        ih = ihex(8)
+        del ih[6:1:-2]
+        self.assertEqual({0:0, 1:1, 3:3, 5:5, 7:7}, ih.todict())
+
+    def test_slice_sparse(self):
+        # time of slice operations depends on amount of data only
+        ih = IntelHex({0x08000000: 1, 0x08000001: 2, 0x080FFFFF: 3,
+                       0x20000000: 4})
+        self.assertEqual({0x08000000: 1, 0x08000001: 2, 0x080FFFFF: 3},
+                         ih[0x08000000:0x08100000].todict())
+        self.assertEqual({0x08000000: 1, 0x080FFFFF: 3},
+                         ih[0x08000000:0x08100000:0xFFFFF].todict())
+        self.assertEqual({0x20000000: 4}, ih[0x10000000:].todict())
+        self.assertEqual({0x08000001: 2}, ih[0x08000001:0:-2].todict())
+        del ih[0x08000001:0x20000000]
+        self.assertEqual({0x08000000: 1, 0x20000000: 4}, ih.todict())
 
     def test_addresses(self):
         # empty object
@@ -792,6 +875,15 @@ class TestIntelHex(TestIntelHexBase):
         self.assertEqual(1, ih.minaddr())
         self.assertEqual(10, ih.maxaddr())
 
+    def test_addresses_lazy(self):
+        self.assertEqual([], list(IntelHex().addresses(lazy=True)))
+        for storage in (ExtentStorage, DictStorage):
+            ih = IntelHex({10:0, 1:2, 2:3, 7:8}, storage=storage)
+            aa = ih.addresses(lazy=True)
+            self.assertFalse(isinstance(aa, list))
+            self.assertEqual([1,2,7,10], list(aa))
+            self.assertEqual(4, len(ih))
+
     def test__get_start_end(self):
         # test for private method _get_start_end
         # for empty object
@@ -856,6 +948,346 @@ class TestIntelHex(TestIntelHexBase):
         self.assertEqual(max(sg[1]), 0x205)
         pass
 
+    def test_fill(self):
+        for storage in (None, DictStorage):
+            ih = IntelHex(storage=storage)
+            ih.puts(2, b'\x01\x02')
+            ih.puts(7, b'\x03')
+            ih.fill()
+            self.assertEqual([(2, 8)], ih.segments())
+            self.assertEqual(b'\x01\x02\xFF\xFF\xFF\x03', ih.gets(2, 6))
+            ih.fill(0, 9, value=0)
+            self.assertEqual(b'\x00\x00\x01\x02\xFF\xFF\xFF\x03\x00\x00',
+                             ih.gets(0, 10))
+            ih.fill(3, 4, value=0x55, only_gaps=False)
+            self.assertEqual(b'\x01\x55\x55\xFF', ih.gets(2, 4))
+            self.assertRaises(ValueError, ih.fill, 0, 1, 256)
+        self.assertRaises(intelhex.EmptyIntelHexError, IntelHex().fill)
+
+    def test_pad_to_alignment(self):
+        ih = IntelHex()
+        ih.puts(0x11, b'\x01\x02')
+        ih.puts(0x1E, b'\x03\x04\x05')
+        ih.puts(0x40, b'\x06')
+        ih.puts(0x4F, b'\x07')
+        ih.pad_to_alignment(16)
+        self.assertEqual([(0x10, 0x30), (0x40, 0x50)], ih.segments())
+        self.assertEqual(b'\xFF\x01\x02\xFF', ih.gets(0x10, 4))
+        self.assertEqual(b'\xFF\x03\x04\x05\xFF', ih.gets(0x1D, 5))
+        ih.pad_to_alignment(0x40, value=0)
+        self.assertEqual([(0, 0x80)], ih.segments())
+        self.assertEqual(0, ih[0x50])
+        self.assertRaises(ValueError, ih.pad_to_alignment, 0)
+
+    def test_move(self):
+        for storage in (None, DictStorage):
+            ih = IntelHex(storage=storage)
+            ih.puts(0x10, b'\x01\x02\x03\x04')
+            ih.puts(0x20, b'\x05\x06')
+            ih.puts(0x30, b'\x07')
+            ih.start_addr = {'EIP': 0x21}
+            ih.move(0x12, 0x21, 0x40)
+            self.assertEqual([(0x10, 0x12), (0x30, 0x31), (0x40, 0x42),
+                              (0x4E, 0x50)], ih.segments())
+            self.assertEqual(b'\x03\x04', ih.gets(0x40, 2))
+            self.assertEqual(b'\x05\x06', ih.gets(0x4E, 2))
+            self.assertEqual({'EIP': 0x21}, ih.start_addr)
+            # overlapped ranges, destination data is overwritten
+            ih.move(0x40, 0x4F, 0x30, update_start_addr=True)
+            self.assertEqual([(0x10, 0x12), (0x30, 0x32), (0x3E, 0x40)],
+                             ih.segments())
+            self.assertEqual(b'\x03\x04', ih.gets(0x30, 2))
+            self.assertEqual(b'\x05\x06', ih.gets(0x3E, 2))
+            self.assertEqual({'EIP': 0x21}, ih.start_addr)
+            ih.move(0x10, 0x3F, 0x1000, update_start_addr=True)
+            self.assertEqual({'EIP': 0x1011}, ih.start_addr)
+            self.assertEqual(b'\x01\x02', ih.gets(0x1000, 2))
+            self.assertRaises(ValueError, ih.move, 0x1000, 0x1001, -1)
+            self.assertEqual(b'\x01\x02', ih.gets(0x1000, 2))
+
+    def test_relocate(self):
+        ih = IntelHex()
+        ih.puts(0x100, b'\x01\x02')
+        ih.puts(0x200, b'\x03')
+        data = ih.tobinstr()
+        ih.start_addr = {'CS': 0x10, 'IP': 0x4}
+        ih.relocate(0x8000)
+        self.assertEqual([(0x8100, 0x8102), (0x8200, 0x8201)], ih.segments())
+        self.assertEqual(data, ih.tobinstr())
+        self.assertEqual({'CS': 0x810, 'IP': 0x4}, ih.start_addr)
+        ih.relocate(-0x8001)
+        self.assertEqual(0xFF, ih.minaddr())
+        self.assertEqual({'CS': 0x10, 'IP': 0x3}, ih.start_addr)
+        ih.relocate(1, update_start_addr=False)
+        self.assertEqual(0x100, ih.minaddr())
+        self.assertEqual({'CS': 0x10, 'IP': 0x3}, ih.start_addr)
+        self.assertRaises(ValueError, ih.relocate, -0x101)
+        ih.start_addr = {'EIP': 0x10}
+        self.assertRaises(ValueError, ih.relocate, -0x11)
+        self.assertEqual(0x100, ih.minaddr())
+        # moved extent shares memory with old one
+        ih = IntelHex()
+        ih.puts(0, b'\x01\x02')
+        view = ih.tobinview()
+        ih.relocate(0x10)
+        self.assertEqual(view.obj, ih.tobinview().obj)
+        ih[0x10] = 5
+        self.assertEqual(b'\x01\x02', view.tobytes())
+
+    def test_checksums(self):
+        for storage in (None, DictStorage):
+            ih = IntelHex(storage=storage)
+            ih.puts(0x10, b'123456789')
+            ih.puts(0x30, b'\x01\x02')
+            data = ih.tobinstr()
+            self.assertEqual(zlib.crc32(data) & 0xFFFFFFFF, ih.crc32())
+            self.assertEqual(binascii.crc_hqx(data, 0xFFFF), ih.crc16())
+            self.assertEqual(hashlib.sha256(data).digest(), ih.digest())
+            self.assertEqual(hashlib.md5(data[2:5]).digest(),
+                             ih.digest('md5', 0x12, 0x14))
+            # check values of CRC-16/CCITT-FALSE and CRC-16/BUYPASS
+            self.assertEqual(0x29B1, ih.crc16(0x10, 0x18))
+            self.assertEqual(0xFEE8, ih.crc16(0x10, 0x18, poly=0x8005, init=0))
+            # padding is used for gaps
+            self.assertEqual(zlib.crc32(b'\xFF'*0x20) & 0xFFFFFFFF,
+                             ih.crc32(0x40, 0x5F))
+            ih.padding = 0
+            self.assertEqual(zlib.crc32(b'\x00'*0x20) & 0xFFFFFFFF,
+                             ih.crc32(0x40, 0x5F))
+            self.assertRaises(ValueError, ih.digest, 'no-such-hash')
+
+    def test_checksums_cache(self):
+        ih = IntelHex()
+        ih.puts(0, b'\x01\x02\x03')
+        crc = ih.crc32()
+        self.assertEqual(crc, ih.crc32())
+        self.assertEqual(crc, ih._checksums[2][('crc32', None, None, 0xFF)])
+        # cache is dropped on any change
+        ih[1] = 5
+        self.assertEqual(zlib.crc32(b'\x01\x05\x03'), ih.crc32())
+        ih.puts(3, b'\x04')
+        self.assertEqual(hashlib.sha256(b'\x01\x05\x03\x04').digest(),
+                         ih.digest())
+        del ih[3]
+        self.assertEqual(hashlib.sha256(b'\x01\x05\x03').digest(),
+                         ih.digest())
+        ih.words()[0] = 0x0201
+        self.assertEqual(zlib.crc32(b'\x01\x02\x03'), ih.crc32())
+
+class TestIntelHexStorage(TestIntelHexBase):
+
+    def test_storage_class(self):
+        ih = IntelHex(StringIO(hex64k))
+        self.assertTrue(isinstance(ih._buf, ExtentStorage))
+        ih2 = IntelHex(StringIO(hex64k), storage=DictStorage)
+        self.assertTrue(isinstance(ih2._buf, DictStorage))
+        self.assertEqual(data64k, ih2.todict())
+        ih3 = IntelHex(ih2)
+        self.assertTrue(isinstance(ih3._buf, DictStorage))
+        ih4 = IntelHex(ih2, storage=ExtentStorage)
+        self.assertTrue(isinstance(ih4._buf, ExtentStorage))
+        self.assertEqual(data64k, ih4.todict())
+
+    def test_dict_storage_operations(self):
+        ih = IntelHex(StringIO(hex64k), storage=DictStorage)
+        sio = StringIO()
+        ih.write_hex_file(sio)
+        self.assertEqual(hex64k, sio.getvalue())
+        self.assertEqual(IntelHex(StringIO(hex64k)).tobinstr(), ih.tobinstr())
+        self.assertEqual(IntelHex(StringIO(hex64k)).segments(), ih.segments())
+        ih.merge(IntelHex({0x30000: 1}))
+        self.assertEqual(1, ih[0x30000])
+
+    def test_bounds(self):
+        for storage in (ExtentStorage, DictStorage):
+            ih = IntelHex(storage=storage)
+            self.assertEqual((None, None), (ih.minaddr(), ih.maxaddr()))
+            ih[10] = 1
+            ih[5] = 2
+            ih[20] = 3
+            self.assertEqual((5, 20), (ih.minaddr(), ih.maxaddr()))
+            del ih[20]
+            del ih[5]
+            self.assertEqual((10, 10), (ih.minaddr(), ih.maxaddr()))
+            self.assertRaises(IndexError, ih.__getitem__, 11)
+            ih.fromdict({0: 1, 100: 2})
+            self.assertEqual((0, 100), (ih.minaddr(), ih.maxaddr()))
+            self.assertEqual(0xFF, ih[99])
+            del ih[:]
+            self.assertEqual((None, None), (ih.minaddr(), ih.maxaddr()))
+
+    def test_segments_index(self):
+        for storage in (ExtentStorage, DictStorage):
+            st = storage({0: 0, 1: 1, 5: 5, 6: 6, 7: 7, 10: 10})
+            self.assertEqual([(0, 2), (5, 8), (10, 11)], st.segments())
+            self.assertEqual([(1, 2), (5, 6)], st.segments(1, 6))
+            self.assertEqual([], st.segments(2, 5))
+            st[2] = 2
+            self.assertEqual([(0, 3), (5, 8), (10, 11)], st.segments())
+            st[2] = 3
+            del st[6]
+            self.assertEqual([(0, 3), (5, 6), (7, 8), (10, 11)],
+                             st.segments())
+            st.write(3, b'34')
+            self.assertEqual([(0, 6), (7, 8), (10, 11)], st.segments())
+            st.delete(0, 8)
+            self.assertEqual([(10, 11)], st.segments())
+
+            st.clear()
+            self.assertEqual([], st.segments())
+
+    def test_assign_dict(self):
+        ih = IntelHex()
+        ih._buf = {1: 2, 3: 4}
+        self.assertTrue(isinstance(ih._buf, ExtentStorage))
+        self.assertEqual({1: 2, 3: 4}, ih.todict())
+
+
+class TestExtentStorage(TestIntelHexBase):
+
+    def extents(self, st):
+        return [(a, bytes(d)) for a, d in st.extents()]
+
+    def test_setitem_glue(self):
+        st = ExtentStorage()
+        st[0] = 1
+        st[2] = 3
+        self.assertEqual([(0, b'\x01'), (2, b'\x03')], self.extents(st))
+        st[1] = 2
+        self.assertEqual([(0, b'\x01\x02\x03')], self.extents(st))
+        st[5] = 6
+        st[4] = 5
+        self.assertEqual([(0, b'\x01\x02\x03'), (4, b'\x05\x06')],
+                         self.extents(st))
+        self.assertEqual(5, len(st))
+        self.assertRaises(ValueError, st.__setitem__, 10, 256)
+
+    def test_delitem_split(self):
+        st = ExtentStorage({0: 0, 1: 1, 2: 2, 3: 3})
+        del st[1]
+        self.assertEqual([(0, b'\x00'), (2, b'\x02\x03')], self.extents(st))
+        del st[3]
+        del st[0]
+        self.assertEqual([(2, b'\x02')], self.extents(st))
+        self.assertRaises(KeyError, st.__delitem__, 0)
+
+    def test_write(self):
+        st = ExtentStorage()
+        st.write(10, b'abc')
+        st.write(20, b'xyz')
+        st.write(0, b'01')
+        self.assertEqual([(0, b'01'), (10, b'abc'), (20, b'xyz')],
+                         self.extents(st))
+        st.write(11, b'B')
+        self.assertEqual([(0, b'01'), (10, b'aBc'), (20, b'xyz')],
+                         self.extents(st))
+        st.write(2, b'23')
+        st.write(12, b'CDEFGHIJ')
+        self.assertEqual([(0, b'0123'), (10, b'aBCDEFGHIJxyz')],
+                         self.extents(st))
+        st.write(4, b'.' * 30)
+        self.assertEqual([(0, b'0123' + b'.' * 30)], self.extents(st))
+
+    def test_delete(self):
+        st = ExtentStorage()
+        st.write(0, b'0123456789')
+        st.write(20, b'abcdef')
+        st.delete(5, 22)
+        self.assertEqual([(0, b'01234'), (22, b'cdef')], self.extents(st))
+        st.delete(1, 2)
+        self.assertEqual([(0, b'0'), (2, b'234'), (22, b'cdef')],
+                         self.extents(st))
+        st.delete(100, 200)
+        st.delete(0, 100)
+        self.assertEqual([], self.extents(st))
+
+    def test_extents_range(self):
+        st = ExtentStorage()
+        st.write(0, b'0123')
+        st.write(10, b'abcd')
+        self.assertEqual([(2, b'23'), (10, b'ab')],
+                         [(a, bytes(d)) for a, d in st.extents(2, 12)])
+        self.assertEqual([], list(st.extents(4, 10)))
+        # empty and inverted ranges
+        self.assertEqual([], list(st.extents(2, 2)))
+        self.assertEqual([], list(st.extents(12, 2)))
+        self.assertEqual([], st.segments(11, 11))
+
+    def test_dict_interface(self):
+        d = {1: 2, 2: 3, 10: 4}
+        st = ExtentStorage(d)
+        self.assertEqual(d, st)
+        self.assertEqual(st, d)
+        self.assertEqual([1, 2, 10], st.keys())
+        self.assertEqual(3, st.get(2))
+        self.assertEqual(None, st.get(3))
+        self.assertTrue(10 in st)
+        self.assertFalse(11 in st)
+        st2 = st.copy()
+        st2[1] = 0
+        self.assertEqual(2, st[1])
+        self.assertEqual(DictStorage(d), DictStorage(d).copy())
+
+    def test_attach(self):
+        st = ExtentStorage({0: 0, 10: 10})
+        buf = bytearray(b'abc')
+        st.attach(4, buf)
+        self.assertEqual([(0, 1), (4, 7), (10, 11)], st.segments())
+        # bytes are changed in buffer
+        st[5] = 0x42
+        st.write(6, b'C')
+        self.assertEqual(b'aBC', buf)
+        # size changes continue with a copy
+        st[7] = 0x44
+        st[4] = 0x41
+        self.assertEqual(b'aBC', buf)
+        self.assertEqual([(0, b'\x00'), (4, b'ABCD'), (10, b'\x0a')],
+                         self.extents(st))
+        self.assertRaises(ValueError, st.attach, 8, bytearray(b'x'))
+        self.assertRaises(ValueError, st.attach, 12, b'x')
+        # copy of storage does not share the buffer
+        st = ExtentStorage()
+        st.attach(0, buf)
+        st.copy()[0] = 0x7A
+        self.assertEqual(b'aBC', buf)
+
+    def test_attach_bad_value(self):
+        # rejected value does not detach the buffer
+        st = ExtentStorage()
+        buf = bytearray(b'abc')
+        st.attach(0, buf)
+        self.assertRaises(TypeError, st.__setitem__, 1, 'x')
+        self.assertRaises(TypeError, st.__setitem__, 1, None)
+        self.assertRaises(ValueError, st.__setitem__, 1, 256)
+        st[1] = 0x42
+        self.assertEqual(b'aBc', buf)
+
+
+    def test_lazy_storage(self):
+        loaded = []
+        def region(addr, data):
+            def load():
+                loaded.append(addr)
+                return [(addr, data)]
+            return addr, addr + len(data), load
+        st = LazyStorage({0: 1}, [region(20, b'xyz'), region(10, b'ab')])
+        self.assertEqual([(10, 12), (20, 23)], st.pending())
+        self.assertEqual(6, len(st))
+        self.assertEqual(0, st.minaddr())
+        self.assertEqual(22, st.maxaddr())
+        self.assertEqual([], loaded)
+        self.assertEqual(ord('b'), st[11])
+        self.assertEqual([10], loaded)
+        st2 = st.copy()
+        st.write(19, b'0')
+        self.assertEqual([(0, b'\x01'), (10, b'ab'), (19, b'0xyz')],
+                         self.extents(st))
+        self.assertEqual([10, 20], loaded)
+        self.assertEqual([(20, 23)], st2.pending())
+        self.assertEqual({0: 1, 10: 97, 11: 98, 20: 120, 21: 121, 22: 122},
+                         st2)
+
+
 class TestIntelHexLoadBin(TestIntelHexBase):
 
     def setUp(self):
@@ -893,6 +1325,89 @@ class TestIntelHexLoadBin(TestIntelHexBase):
         self.assertEqual(9, ih.maxaddr())
         self.assertEqual(self.bytes, ih.tobinstr())
 
+    def test_frombytes_buffers(self):
+        for source in (self.bytes,
+                       bytearray(self.bytes),
+                       memoryview(self.bytes),
+                       array.array('B', self.bytes),
+                       list(array.array('B', self.bytes))):
+            ih = IntelHex()
+            ih.frombytes(source, offset=5)
+            self.assertEqual([(5, 15)], ih.segments())
+            self.assertEqual(self.bytes, ih.tobinstr())
+
+    def test_frombytes_no_copy(self):
+        source = bytearray(self.bytes)
+        ih = IntelHex()
+        ih.frombytes(source, copy=False)
+        self.assertEqual(self.bytes, ih.tobinstr())
+        # data is copied on first modification, source is never changed
+        ih[0] = 0x41
+        ih[10] = 0x42
+        del ih[5]
+        self.assertEqual(b'A1234', ih.tobinstr(0, 4))
+        self.assertEqual(self.bytes, source)
+        # the same with slices of view
+        ih = IntelHex()
+        ih.frombytes(source, copy=False)
+        del ih[2:4]
+        ih.puts(6, b'xy')
+        self.assertEqual({0: 0x30, 1: 0x31, 4: 0x34, 5: 0x35, 6: 0x78,
+                          7: 0x79, 8: 0x38, 9: 0x39}, ih.todict())
+        self.assertEqual(self.bytes, source)
+
+    def _temp_bin(self):
+        fd, fname = tempfile.mkstemp()
+        os.write(fd, self.bytes)
+        os.close(fd)
+        return fname
+
+    def _read(self, fname):
+        f = open(fname, 'rb')
+        try:
+            return f.read()
+        finally:
+            f.close()
+
+    def test_loadbin_mapped(self):
+        fname = self._temp_bin()
+        try:
+            ih = IntelHex()
+            ih.loadbin(fname, offset=0x10, mapped=True)
+            self.assertEqual([(0x10, 0x1A)], ih.segments())
+            self.assertEqual(0x31, ih[0x11])
+            ih.puts(0x10, b'AB')
+            ih[0x1A] = 0x43
+            self.assertEqual(b'AB23456789C', ih.tobinstr())
+            sio = StringIO()
+            ih.write_hex_file(sio)
+            self.assertEqual(ih.todict(), IntelHex(StringIO(sio.getvalue())).todict())
+            del ih
+            # file is not changed
+            self.assertEqual(self.bytes, self._read(fname))
+        finally:
+            os.remove(fname)
+        # not a real file is read as usual
+        ih = IntelHex()
+        ih.loadbin(self.f, mapped=True)
+        self.assertEqual(self.bytes, ih.tobinstr())
+
+    def test_loadbin_write_through(self):
+        fname = self._temp_bin()
+        try:
+            ih = IntelHex()
+            ih.loadbin(fname, mapped=True, write_through=True)
+            ih.puts(2, b'AB')
+            ih[9] = 0x43
+            copy = IntelHex(ih)
+            copy[0] = 0x44
+            self.assertEqual(b'01AB45678C', self._read(fname))
+            del ih, copy
+        finally:
+            os.remove(fname)
+        self.assertRaisesMsg(ValueError, 'file can not be mapped for writing',
+            IntelHex().loadbin, self.f, mapped=True, write_through=True)
+
 
 class TestIntelHexStartingAddressRecords(TestIntelHexBase):
 
@@ -996,6 +1511,13 @@ class TestIntelHexGetPutString(TestIntelHexBase):
         self.ih.puts(0x03, asbytes('hello'))
         self.assertEqual(asbytes('\x00\x01\x02hello\x08\x09'), self.ih.gets(0, 10))
 
+    def test_puts_buffers(self):
+        self.ih.puts(0x01, bytearray(b'ab'))
+        self.ih.puts(0x04, memoryview(b'cd'))
+        self.ih.puts(0x08, array.array('B', b'efg'))
+        self.assertEqual(b'\x00ab\x03cd\x06\x07efg', self.ih.gets(0, 11))
+        self.assertEqual([(0, 11)], self.ih.segments())
+
     def test_getsz(self):
         self.assertEqual(asbytes(''), self.ih.getsz(0))
         self.assertRaisesMsg(intelhex.NotEnoughDataError,
@@ -1005,10 +1527,46 @@ class TestIntelHexGetPutString(TestIntelHexBase):
         self.ih[4] = 0
         self.assertEqual(asbytes('\x01\x02\x03'), self.ih.getsz(1))
 
+    def test_getsz_long(self):
+        self.ih.puts(0x100, b'x' * 5000 + b'\0' + b'y' * 10000)
+        self.assertEqual(b'x' * 5000, self.ih.getsz(0x100))
+        self.assertEqual(b'x' * 10, self.ih.getsz(0x100 + 4990))
+        self.assertEqual(b'', self.ih.getsz(0x100 + 5000))
+        self.assertRaises(intelhex.NotEnoughDataError,
+                          self.ih.getsz, 0x100 + 5001)
+        self.assertRaises(intelhex.NotEnoughDataError, self.ih.getsz, 0x50)
+
+    def test_getsz_dict_storage(self):
+        # only addresses near the string are looked at
+        calls = []
+        class Storage(DictStorage):
+            def extents(self, start=None, stop=None):
+                calls.append((start, stop))
+                return DictStorage.extents(self, start, stop)
+        ih = IntelHex(storage=Storage)
+        ih.puts(0, b'z' * 10000)
+        ih.puts(0x10000, b'x' * 100 + b'\0')
+        ih.puts(0x20000, b'y' * 100)
+        self.assertEqual(b'x' * 100, ih.getsz(0x10000))
+        self.assertRaises(intelhex.NotEnoughDataError, ih.getsz, 0x20000)
+        self.assertTrue(calls)
+        for start, stop in calls:
+            self.assertTrue(stop is not None and stop - start < 1000)
+
     def test_putsz(self):
         self.ih.putsz(0x03, asbytes('hello'))
         self.assertEqual(asbytes('\x00\x01\x02hello\x00\x09'), self.ih.gets(0, 10))
 
+    def test_putsz_non_byte_buffer(self):
+        # terminator goes after the last byte, not after len() items
+        ih = IntelHex()
+        ih.putsz(0, array.array('H', [0x4141, 0x4242]))
+        self.assertEqual(b'AABB\x00', ih.tobinstr())
+        ih = IntelHex()
+        ih.putsz(0, memoryview(b'ABCD').cast('H'))
+        self.assertEqual(b'ABCD\x00', ih.tobinstr())
+        self.assertEqual(b'ABCD', ih.getsz(0))
+
     def test_find(self):
         self.assertEqual(0, self.ih.find(asbytes('\x00\x01\x02\x03\x04\x05\x06')))
         self.assertEqual(0, self.ih.find(asbytes('\x00')))
@@ -1054,6 +1612,62 @@ class TestIntelHexGetPutString(TestIntelHexBase):
         self.assertEqual(-1, self.ih.find(asbytes('\x08\x07'), start=3, end=7))
 
 
+    def test_find_adjacent_segments(self):
+        ih = IntelHex()
+        ih.puts(0x100, b'abcXY')
+        ih.puts(0x105, b'Zdef')
+        ih.puts(0x200, b'XYZ')
+        self.assertEqual(0x103, ih.find(b'XYZ'))
+        self.assertEqual(0x200, ih.find(b'XYZ', start=0x104))
+        self.assertEqual(-1, ih.find(b'fXY'))
+
+    def test_rfind(self):
+        ih = IntelHex()
+        ih.puts(0x100, b'abab')
+        ih.puts(0x200, b'xab' + b'\xff' * 1000)
+        self.assertEqual(0x201, ih.rfind(b'ab'))
+        self.assertEqual(0x102, ih.rfind(b'ab', end=0x200))
+        self.assertEqual(0x100, ih.rfind(b'ab', end=0x103))
+        self.assertEqual(-1, ih.rfind(b'ab', start=0x202))
+        self.assertEqual(-1, ih.rfind(b'ba', start=0x102))
+        self.assertEqual(0x104, ih.rfind(b'', end=0x200))
+
+    def test_findall(self):
+        ih = IntelHex()
+        ih.puts(0x100, b'aaab')
+        ih.puts(0x200, b'aa')
+        self.assertEqual([0x100, 0x101, 0x200], ih.findall(b'aa'))
+        self.assertEqual([0x101], ih.findall(b'aa', start=0x101, end=0x200))
+        self.assertEqual([], ih.findall(b'ba'))
+        self.assertRaises(ValueError, ih.findall, b'')
+
+    def test_find_any(self):
+        ih = IntelHex()
+        ih.puts(0x100, b'he said: she sells his shells')
+        patterns = [b'he', b'she', b'his', b'hers', b'shells']
+        self.assertEqual([(0x100, b'he'),
+                          (0x109, b'she'), (0x10A, b'he'),
+                          (0x113, b'his'),
+                          (0x117, b'she'), (0x117, b'shells'),
+                          (0x118, b'he'),
+                         ], ih.find_any(patterns))
+        self.assertEqual([(0x113, b'his')],
+                         ih.find_any(patterns, start=0x10B, end=0x118))
+        self.assertEqual([], ih.find_any([]))
+        self.assertRaises(ValueError, ih.find_any, [b'he', b''])
+
+    def test_find_long_pattern(self):
+        n = sys.getrecursionlimit() + 100
+        sub = bytes(bytearray(i & 0xFF for i in range(n)))
+        ih = IntelHex()
+        ih.puts(0x10, b'x' + sub + b'y' + sub)
+        self.assertEqual(0x11, ih.find(sub))
+        self.assertEqual(0x12+n, ih.rfind(sub))
+        self.assertEqual([0x11, 0x12+n], ih.findall(sub))
+        self.assertEqual([(0x11, sub), (0x11, sub + b'y'), (0x12+n, sub)],
+                         ih.find_any([sub, sub + b'y', sub[1:] + b'z']))
+        self.assertEqual(-1, ih.find(b'', 0x20, 0x18))
+
 class TestIntelHexDump(TestIntelHexBase):
 
     def test_empty(self):
@@ -1208,6 +1822,38 @@ class TestIntelHexMerge(TestIntelHexBase):
         ih1.merge(ih2, overlap='replace')
         self.assertEqual({0:2}, ih1.todict())
 
+    def test_merge_overlap_ranges(self):
+        ih1 = IntelHex({0:1, 1:2, 5:3, 0x10:4})
+        ih2 = IntelHex({1:1, 2:2, 3:3, 5:5, 0x10:6, 0x11:7, 0x20:8})
+        try:
+            ih1.merge(ih2)
+        except AddressOverlapError:
+            e = sys.exc_info()[1]
+            self.assertEqual([(1, 2), (5, 6), (0x10, 0x11)], e.ranges)
+            self.assertEqual('Data overlapped at addresses 0x1, 0x5, 0x10',
+                             str(e))
+        else:
+            self.fail('AddressOverlapError is not raised')
+        # self is not changed
+        self.assertEqual({0:1, 1:2, 5:3, 0x10:4}, ih1.todict())
+        ih1 = IntelHex()
+        ih1.puts(0x100, b'a' * 0x100)
+        ih2 = IntelHex()
+        ih2.puts(0x80, b'b' * 0x100)
+        self.assertRaisesMsg(AddressOverlapError,
+            'Data overlapped at addresses 0x100-0x17F',
+            ih1.merge, ih2)
+
+    def test_merge_no_overlap(self):
+        ih1 = IntelHex()
+        ih1.puts(0, b'a' * 0x100)
+        ih2 = IntelHex()
+        ih2.puts(0x100, b'b' * 0x100)
+        ih2.puts(0x300, b'c' * 0x10)
+        ih1.merge(ih2)
+        self.assertEqual([(0, 0x200), (0x300, 0x310)], ih1.segments())
+        self.assertEqual(b'a' * 0x100 + b'b' * 0x100, ih1.gets(0, 0x200))
+
     def test_merge_start_addr(self):
         # this, None
         ih1 = IntelHex({'start_addr': {'EIP': 0x12345678}})
@@ -1243,6 +1889,121 @@ class TestIntelHexMerge(TestIntelHexBase):
         self.assertEqual({'start_addr': {'EIP': 0x87654321}}, ih1.todict())
 
 
+class TestMergeMany(TestIntelHexBase):
+
+    def _sources(self):
+        ih1 = IntelHex()
+        ih1.puts(0, b'aaaa')
+        ih2 = IntelHex()
+        ih2.puts(2, b'bbbb')
+        ih3 = IntelHex()
+        ih3.puts(3, b'c')
+        return [ih1, ih2, ih3]
+
+    def test_merge_many(self):
+        ih1 = IntelHex({0:1, 'start_addr': {'EIP': 0x1234}})
+        ih2 = IntelHex({1:2, 5:3})
+        sio = StringIO()
+        ih3 = IntelHex({2:4})
+        ih3.write_hex_file(sio)
+        sio.seek(0)
+        res = merge_many([ih1, ih2, sio])
+        self.assertEqual({0:1, 1:2, 2:4, 5:3, 'start_addr': {'EIP': 0x1234}},
+                         res.todict())
+        # sources are not changed by changes of result
+        res[0] = 0x55
+        self.assertEqual(1, ih1[0])
+        self.assertEqual({}, merge_many([]).todict())
+
+    def test_overlap(self):
+        self.assertEqual(b'aaaabb',
+            merge_many(self._sources(), overlap='ignore').gets(0, 6))
+        self.assertEqual(b'aabcbb',
+            merge_many(self._sources(), overlap='replace').gets(0, 6))
+        sources = self._sources()
+        try:
+            merge_many(sources)
+        except AddressOverlapError:
+            e = sys.exc_info()[1]
+            self.assertEqual([(2, 4)], e.ranges)
+            self.assertEqual(1, e.source)
+        else:
+            self.fail('AddressOverlapError is not raised')
+        self.assertRaisesMsg(ValueError, "overlap argument should be either "
+            "'error', 'ignore' or 'replace'",
+            merge_many, sources, overlap='spam')
+
+    def test_ranges(self):
+        res = merge_many(self._sources(), ranges=[(None, 2), (4, None), None])
+        self.assertEqual([(0, 2), (3, 6)], res.segments())
+        self.assertEqual(b'aa', res.gets(0, 2))
+        self.assertEqual(b'cbb', res.gets(3, 3))
+        self.assertRaises(ValueError, merge_many, self._sources(),
+                          ranges=[None])
+
+    def test_start_addr(self):
+        ih1 = IntelHex({'start_addr': {'EIP': 1}})
+        ih2 = IntelHex({'start_addr': {'EIP': 2}})
+        self.assertRaisesMsg(AddressOverlapError,
+            'Starting addresses are different',
+            merge_many, [ih1, ih2])
+        self.assertEqual({'EIP': 1},
+            merge_many([ih1, ih2], overlap='ignore').start_addr)
+        self.assertEqual({'EIP': 2},
+            merge_many([ih1, ih2], overlap='replace').start_addr)
+        # start address of source with range is not used
+        self.assertEqual({'EIP': 1},
+            merge_many([ih1, ih2], ranges=[None, (0, 10)]).start_addr)
+        # the first source which can't be merged is reported
+        ih3 = IntelHex({0: 1, 'start_addr': {'EIP': 1}})
+        for sources, source in (([ih1, ih2, ih3], 1),
+                                ([ih3, ih1, ih2, ih3], 2),
+                                ([ih3, ih2, ih3], 1)):
+            try:
+                merge_many(sources)
+            except AddressOverlapError:
+                self.assertEqual(source, sys.exc_info()[1].source)
+            else:
+                self.fail('AddressOverlapError is not raised')
+
+    def test_hexmerge_script(self):
+        from intelhex.scripts import hexmerge
+        tmpdir = tempfile.mkdtemp()
+        try:
+            names = []
+            for i, data in enumerate((b'aa', b'bb', b'cc')):
+                ih = IntelHex()
+                ih.puts(i*4, data)
+                if i == 2:
+                    ih.puts(1, b'x')
+                names.append(os.path.join(tmpdir, 'f%d.hex' % i))
+                ih.write_hex_file(names[-1])
+            out = os.path.join(tmpdir, 'out.hex')
+            stderr = sys.stderr
+            sys.stderr = StringIO()
+            try:
+                self.assertEqual(1, hexmerge.main(['-o', out] + names))
+                msg = sys.stderr.getvalue()
+            finally:
+                sys.stderr = stderr
+            self.assertEqual('Merging: %s\n'
+                             'Data overlapped at address 0x1\n' % names[2],
+                             msg)
+        finally:
+            for name in os.listdir(tmpdir):
+                os.remove(os.path.join(tmpdir, name))
+            os.rmdir(tmpdir)
+
+    def test_fout(self):
+        sources = self._sources()
+        expected = StringIO()
+        merge_many(sources, overlap='replace').write_hex_file(expected)
+        sio = StringIO()
+        self.assertEqual(None,
+            merge_many(sources, overlap='replace', fout=sio))
+        self.assertEqual(expected.getvalue(), sio.getvalue())
+
+
 class TestIntelHex16bit(TestIntelHexBase):
 
     def setUp(self):
@@ -1334,9 +2095,110 @@ class TestIntelHex16bit(TestIntelHexBase):
         ih.padding = 0x3FFF
         self.assertEqual(array.array('H', [0x1234,0x5678,0x3FFF]),
                          ih.tobinarray(start=0, end=2))
+
+    def test_tobinarray_segments(self):
+        for storage in (None, intelhex.DictStorage):
+            ih = intelhex.IntelHex16bit(storage=storage)
+            ih.puts(4, b'\x01\x02\x03\x04')
+            ih.puts(20, b'\x05\x06')
+            ih.padding = 0x3FFF
+            expected = array.array('H', [ih[i] for i in range_g(0, 13)])
+            self.assertEqual(expected, ih.tobinarray(0, 12))
+            self.assertEqual(array.array('H', [0x0201, 0x0403, 0x3FFF]),
+                             ih.tobinarray(2, 4))
+            self.assertEqual(array.array('H', [0x0403, 0x3FFF]),
+                             ih.tobinarray(start=3, size=2))
+        # half of the word is set
+        ih = intelhex.IntelHex16bit(intelhex.IntelHex())
+        ih.puts(4, b'\x01\x02\x03')
+        self.assertRaisesMsg(BadAccess16bit,
+                             'Bad access at 0x3: '
+                             'not enough data to read 16 bit value',
+                             ih.tobinarray, 0, 5)
+        self.assertEqual(array.array('H', [0xFFFF, 0xFFFF, 0x0201]),
+                         ih.tobinarray(0, 2))
+        ih = intelhex.IntelHex16bit(intelhex.IntelHex())
+        ih.puts(5, b'\x01')
+        self.assertRaises(BadAccess16bit, ih.tobinarray, 0, 5)
+
+    def test_getwords_putwords(self):
+        ih = intelhex.IntelHex16bit()
+        ih.putwords(2, [0x1234, 0x5678])
+        ih.putwords(4, array.array('H', [0x9ABC]))
+        self.assertEqual(b'\x34\x12\x78\x56\xBC\x9A', ih.gets(4, 6))
+        self.assertEqual(array.array('H', [0x5678, 0x9ABC]),
+                         ih.getwords(3, 2))
+        self.assertEqual(array.array('H'), ih.getwords(10, 0))
+        self.assertRaisesMsg(NotEnoughDataError,
+                             'Bad access at 0x4: '
+                             'not enough data to read 8 contiguous bytes',
+                             ih.getwords, 2, 4)
+        self.assertRaises(NotEnoughDataError, ih.getwords, 1, 2)
 #/class TestIntelHex16bit
 
 
+class TestIntelHexWords(TestIntelHexBase):
+
+    def test_shared_data(self):
+        ih = intelhex.IntelHex()
+        ih.puts(0, b'\x01\x02\x03\x04')
+        w = ih.words()
+        self.assertEqual(0x0201, w[0])
+        self.assertEqual(array.array('H', [0x0201, 0x0403]), w.tobinarray())
+        w[1] = 0xBBAA
+        self.assertEqual(b'\x01\x02\xAA\xBB', ih.gets(0, 4))
+        ih[4] = 0x05
+        ih[5] = 0x06
+        self.assertEqual(array.array('H', [0x0605]), w.getwords(2, 1))
+        self.assertEqual(2, w.maxaddr())
+        # object is not changed by view
+        self.assertEqual(0x0FF, ih.padding)
+        self.assertEqual(0x0FFFF, w.padding)
+        self.assertEqual(0x0FFFF, w[3])
+        # start address is shared
+        w.start_addr = {'EIP': 0x100}
+        self.assertEqual({'EIP': 0x100}, ih.start_addr)
+        # view follows reloaded data
+        del ih[0:6]
+        ih.start_addr = None
+        ih.loadhex(StringIO(hex16))
+        self.assertEqual(intelhex.IntelHex16bit(StringIO(hex16)).tobinarray(),
+                         w.tobinarray())
+
+    def test_byteorder(self):
+        ih = intelhex.IntelHex()
+        ih.padding = 0
+        ih.puts(0, b'\x01\x02\x03\x04\x05\x06\x07\x08')
+        w = ih.words(byteorder='big')
+        self.assertEqual(0x0102, w[0])
+        self.assertEqual(array.array('H', [0x0102, 0x0304, 0x0506, 0x0708, 0]),
+                         w.tobinarray(0, 4))
+        w.putwords(0, [0x1122])
+        self.assertEqual(b'\x11\x22', ih.gets(0, 2))
+        w32 = ih.words('I')
+        self.assertEqual(0x08070605, w32[1])
+        self.assertEqual(array.array('I', [0x04032211, 0x08070605, 0]),
+                         w32.tobinarray(0, 2))
+        w32 = ih.words('I', 'big')
+        self.assertEqual(array.array('I', [0x11220304, 0x05060708]),
+                         w32.getwords(0, 2))
+        w32[2] = 0x0A0B0C0D
+        self.assertEqual(b'\x0A\x0B\x0C\x0D', ih.gets(8, 4))
+
+    def test_bad_access(self):
+        ih = intelhex.IntelHex()
+        ih.puts(2, b'\x01\x02\x03')
+        self.assertRaises(BadAccess16bit, lambda: ih.words()[2])
+        self.assertRaisesMsg(NotEnoughDataError,
+                             'Bad access at 0x0: '
+                             'not enough data to read 4 contiguous bytes',
+                             lambda: ih.words('I')[0])
+        self.assertRaises(NotEnoughDataError, ih.words('I').tobinarray)
+        self.assertRaises(ValueError, ih.words, 'B')
+        self.assertRaises(ValueError, ih.words, 'H', 'middle')
+#/class TestIntelHexWords
+
+
 class TestIntelHexErrors(TestIntelHexBase):
     """Tests for custom errors classes"""
 
@@ -1579,6 +2441,383 @@ class TestDecodeHexRecords(TestIntelHexBase):
 #/class TestDecodeHexRecords
 
 
+class TestLoadHexBulk(TestIntelHexBase):
+    """Testing bulk decoder used by loadhex"""
+
+    def load(self, hexstr, chunk=None):
+        ih = IntelHex()
+        if chunk is not None:
+            ih._LOADHEX_CHUNK = chunk
+        ih.loadhex(StringIO(hexstr))
+        return ih
+
+    def test_same_data_any_chunk(self):
+        for hexstr in (hex8, hex64k, hex_rectype3, hex_rectype5):
+            expected = self.load(hexstr, 1)
+            for chunk in (2, 3, 7, 100):
+                ih = self.load(hexstr, chunk)
+                self.assertEqual(expected.todict(), ih.todict())
+
+    def test_errors_line_numbers(self):
+        good = ':0100000000FF\n:0100010000FE\n'
+        bad = [
+            (':0100020000FC', RecordChecksumError),
+            (':0200020000FC', RecordLengthError),
+            (':010002FF00FD', RecordTypeError),
+            (':0100020000F', HexRecordError),
+            (':01000200', HexRecordError),
+            ('0100020000FD', HexRecordError),
+            (':0100020000FX', HexRecordError),
+            (':0100000100FE', EOFRecordError),
+            (':00000004FC', ExtendedLinearAddressRecordError),
+            (':0100000000FF', AddressOverlapError),
+            ]
+        for record, error in bad:
+            for chunk in (1, 2, 100):
+                self.assertRaisesMsg(error, None, self.load,
+                                     good + record + '\n' + good, chunk)
+                try:
+                    self.load(good + record + '\n' + good, chunk)
+                except error:
+                    e = sys.exc_info()[1]
+                    if error is not EOFRecordError:
+                        self.assertEqual(3, e.line)
+
+    def test_overlap_line(self):
+        hexstr = (':0400000001020304F2\n'
+                  ':0400040005060708DE\n'
+                  ':00000001FF\n')
+        ih = IntelHex()
+        ih[6] = 0
+        try:
+            ih.loadhex(StringIO(hexstr))
+        except AddressOverlapError:
+            e = sys.exc_info()[1]
+            self.assertEqual(6, e.address)
+            self.assertEqual(2, e.line)
+        else:
+            self.fail('AddressOverlapError is not raised')
+
+    def test_empty_data_record(self):
+        # empty record at address with data is not overlap
+        hexstr = ':0400000001020304F2\n:00000200FE\n:00000001FF\n'
+        for chunk in (1, 100):
+            ih = self.load(hexstr, chunk)
+            self.assertEqual({0: 1, 1: 2, 2: 3, 3: 4}, ih.todict())
+
+    def test_first_error_wins(self):
+        # overlap is reported before errors of later records in chunk
+        hexstr = ''.join([
+            Record.data(0, [1, 2, 3, 4]) + '\n',
+            Record.data(0x10, [1]) + '\n',
+            Record.data(0x11, [2]) + '\n',
+            Record.data(2, [5]) + '\n',
+            Record.data(3, [6]) + '\n',
+            Record.start_linear_address(0x100) + '\n',
+            Record.start_linear_address(0x200) + '\n',
+            Record.eof() + '\n',
+            ])
+        for chunk in (1, 3, 100):
+            try:
+                self.load(hexstr, chunk)
+            except AddressOverlapError:
+                e = sys.exc_info()[1]
+                self.assertEqual(4, e.line)
+                self.assertEqual(2, e.address)
+            else:
+                self.fail('AddressOverlapError is not raised')
+
+    def test_stop_on_eof(self):
+        ih = self.load(':0100000000FF\n:00000001FF\n\ngarbage\n')
+        self.assertEqual({0: 0}, ih.todict())
+
+    def test_empty_lines(self):
+        ih = self.load('\n:0100000000FF\n\n:0100010000FE\n:00000001FF\n')
+        self.assertEqual({0: 0, 1: 0}, ih.todict())
+
+
+class TestLoadHexLazy(TestIntelHexBase):
+    """Testing lazy loading of hex files"""
+
+    def setUp(self):
+        ih = IntelHex()
+        ih.puts(0, b'vectors' * 10)
+        ih.puts(0x1FFF0, b'x' * 0x40)    # crosses 64K boundary
+        ih.puts(0x30000, b'abc')
+        ih.start_addr = {'EIP': 0x1234}
+        sio = StringIO()
+        ih.write_hex_file(sio)
+        self.hexstr = sio.getvalue()
+        self.expected = ih.todict()
+        self.fname = self._write(self.hexstr)
+
+    def tearDown(self):
+        os.remove(self.fname)
+
+    def _write(self, hexstr, fname=None):
+        if fname is None:
+            fd, fname = tempfile.mkstemp()
+            os.close(fd)
+        f = open(fname, 'w')
+        try:
+            f.write(hexstr)
+        finally:
+            f.close()
+        return fname
+
+    def test_lazy(self):
+        ih = IntelHex(self.fname, lazy=True)
+        self.assertTrue(isinstance(ih._buf, LazyStorage))
+        self.assertEqual({'EIP': 0x1234}, ih.start_addr)
+        self.assertEqual(0, ih.minaddr())
+        self.assertEqual(0x30002, ih.maxaddr())
+        self.assertEqual(len(self.expected) - 1, len(ih))
+        self.assertEqual(ord('v'), ih[0])
+        # only accessed data was decoded
+        self.assertEqual([(0x1FFF0, 0x20000), (0x20000, 0x20030),
+                          (0x30000, 0x30003)], ih._buf.pending())
+        self.assertEqual(b'abc', ih.gets(0x30000, 3))
+        self.assertEqual(self.expected, ih.todict())
+        self.assertEqual([], ih._buf.pending())
+
+    def test_same_data(self):
+        for hexstr in (hex8, hex16, hex64k, hex_rectype3, hex_rectype5,
+                       self.hexstr.replace('\n', '\r\n')):
+            fname = self._write(hexstr, self.fname)
+            self.assertEqual(IntelHex(fname).todict(),
+                             IntelHex(fname, lazy=True).todict())
+
+    def test_errors(self):
+        lines = self.hexstr.splitlines(True)
+        # bad data record is reported when its data is accessed
+        lines[8] = lines[8][:-3] + '00\n'
+        self._write(''.join(lines), self.fname)
+        ih = IntelHex(self.fname, lazy=True)
+        self.assertEqual(ord('v'), ih[0])
+        try:
+            ih[0x1FFF0]
+        except RecordChecksumError:
+            e = sys.exc_info()[1]
+            self.assertEqual(9, e.line)
+        else:
+            self.fail('RecordChecksumError is not raised')
+        # other errors are reported on loading
+        lines = self.hexstr.splitlines(True)
+        self._write(''.join(lines[:3] + lines[1:]), self.fname)
+        self.assertRaises(AddressOverlapError,
+                          IntelHex, self.fname, lazy=True)
+
+    def test_file_changed(self):
+        ih = IntelHex(self.fname, lazy=True)
+        self._write(self.hexstr.replace(':', ':\n'), self.fname)
+        self.assertRaisesMsg(HexReaderError,
+            'Hex file %s was changed after loading' % self.fname,
+            ih.tobinarray)
+
+    def _no_scan(self, fobj):
+        self.fail('file is scanned')
+
+    def test_index(self):
+        idx = self.fname + '.idx'
+        try:
+            ih = IntelHex(self.fname, lazy=True, index=True)
+            self.assertTrue(os.path.isfile(idx))
+            self.assertEqual(self.expected, ih.todict())
+            scan = intelhex._HexIndexer.scan
+            intelhex._HexIndexer.scan = self._no_scan
+            try:
+                ih = IntelHex(self.fname, lazy=True, index=True)
+            finally:
+                intelhex._HexIndexer.scan = scan
+            self.assertEqual(self.expected, ih.todict())
+            # changed file is scanned again
+            changed = IntelHex(StringIO(self.hexstr))
+            changed[0x1FFF0] = ord('y')
+            changed.write_hex_file(self.fname)
+            os.utime(self.fname, (0, 0))
+            ih = IntelHex(self.fname, lazy=True, index=True)
+            self.assertEqual(ord('y'), ih[0x1FFF0])
+            # bad index is ignored
+            self._write('garbage', idx)
+            ih = IntelHex(self.fname, lazy=True, index=True)
+            self.assertEqual(ord('y'), ih[0x1FFF0])
+        finally:
+            if os.path.exists(idx):
+                os.remove(idx)
+
+    def test_index_cache_dir(self):
+        cache = tempfile.mkdtemp()
+        try:
+            IntelHex(self.fname, lazy=True, index=cache)
+            self.assertEqual(1, len(os.listdir(cache)))
+            scan = intelhex._HexIndexer.scan
+            intelhex._HexIndexer.scan = self._no_scan
+            try:
+                ih = IntelHex(self.fname, lazy=True, index=cache)
+            finally:
+                intelhex._HexIndexer.scan = scan
+            self.assertEqual(self.expected, ih.todict())
+        finally:
+            for name in os.listdir(cache):
+                os.remove(os.path.join(cache, name))
+            os.rmdir(cache)
+
+    def test_not_lazy(self):
+        ih = IntelHex(StringIO(self.hexstr), lazy=True)
+        self.assertTrue(isinstance(ih._buf, ExtentStorage))
+        self.assertFalse(isinstance(ih._buf, LazyStorage))
+        ih = IntelHex(self.fname, storage=DictStorage, lazy=True)
+        self.assertEqual(self.expected, ih.todict())
+
+
+
+
+class TestSnapshot(TestIntelHexBase):
+
+    def setUp(self):
+        self.ih = IntelHex()
+        self.ih.puts(0, b'abc')
+        self.ih.puts(0x10000, b'x' * 1000)
+        self.ih.padding = 0
+        self.ih.start_addr = {'CS': 0x1234, 'IP': 0x5678}
+
+    def _snapshot(self, checksum=True):
+        f = BytesIO()
+        self.ih.save_snapshot(f, checksum)
+        return f.getvalue()
+
+    def _check(self, ih):
+        self.assertEqual(self.ih.todict(), ih.todict())
+        self.assertEqual(0, ih.padding)
+
+    def test_snapshot(self):
+        data = self._snapshot()
+        self.assertEqual(b'IHEXSNAP', data[:8])
+        self.assertEqual(56 + 2*16 + 1003, len(data))
+        ih = IntelHex()
+        ih.load_snapshot(BytesIO(data))
+        self._check(ih)
+        # data can be changed after loading
+        ih.puts(2, b'CD')
+        self.assertEqual(b'abCD', ih.gets(0, 4))
+        ih = IntelHex()
+        ih.load_snapshot(BytesIO(self._snapshot(checksum=False)))
+        self._check(ih)
+
+    def test_snapshot_big_endian(self):
+        # table is swapped on big-endian hosts, checksum is over file bytes
+        byteorder = sys.byteorder
+        sys.byteorder = {'little': 'big', 'big': 'little'}[byteorder]
+        try:
+            data = self._snapshot()
+            ih = IntelHex()
+            ih.load_snapshot(BytesIO(data))
+        finally:
+            sys.byteorder = byteorder
+        self._check(ih)
+        # empty object
+        self.ih = IntelHex()
+        ih = IntelHex()
+        ih.load_snapshot(BytesIO(self._snapshot()))
+        self.assertEqual({}, ih.todict())
+        self.assertEqual(0xFF, ih.padding)
+
+    def test_snapshot_file(self):
+        fd, fname = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            self.ih.save_snapshot(fname)
+            for mapped in (False, True):
+                ih = IntelHex()
+                ih.load_snapshot(fname, mapped=mapped)
+                self._check(ih)
+                ih[0] = 0x41
+                del ih
+            ih = intelhex.IntelHex16bit()
+            ih.load_snapshot(fname)
+            self.assertEqual(0x6261, ih[0])
+            # file is never changed
+            f = open(fname, 'rb')
+            try:
+                self.assertEqual(self._snapshot(), f.read())
+            finally:
+                f.close()
+        finally:
+            os.remove(fname)
+
+    def test_errors(self):
+        data = self._snapshot()
+        bad = data[:-1] + b'y'
+        self.assertRaisesMsg(SnapshotError,
+            'Bad snapshot file: checksum mismatch',
+            IntelHex().load_snapshot, BytesIO(bad))
+        ih = IntelHex()
+        ih.load_snapshot(BytesIO(bad), verify=False)
+        self.assertEqual(ord('y'), ih[0x10000 + 999])
+        self.assertRaisesMsg(SnapshotError,
+            'Bad snapshot file: bad signature',
+            IntelHex().load_snapshot, BytesIO(b'X' + data[1:]))
+        for n in (10, 60, 100, len(data) - 1):
+            self.assertRaisesMsg(SnapshotError,
+                'Bad snapshot file: file is too short',
+                IntelHex().load_snapshot, BytesIO(data[:n]))
+
+
+class TestIterRecords(TestIntelHexBase):
+
+    def test_records(self):
+        hexstr = (':0400000512345678E3\n'
+                  ':020000040001F9\n'
+                  ':020010000102EB\n'
+                  ':020000021000EC\n'
+                  ':0100200003DC\n'
+                  ':00000001FF\n'
+                  ':0100000000FF\n')
+        records = [(t, a, bytes(d))
+                   for t, a, d in intelhex.iter_records(StringIO(hexstr))]
+        self.assertEqual([
+            (5, 0, b'\x12\x34\x56\x78'),
+            (4, 0, b'\x00\x01'),
+            (0, 0x10010, b'\x01\x02'),
+            (2, 0, b'\x10\x00'),
+            (0, 0x10020, b'\x03'),
+            (1, 0, b''),
+            ], records)
+
+    def test_data_same_as_loadhex(self):
+        ih = IntelHex()
+        for t, a, d in intelhex.iter_records(StringIO(hex64k)):
+            if t == 0:
+                ih.puts(a, asstr(bytes(d)))
+        self.assertEqual(data64k, ih.todict())
+
+    def test_errors(self):
+        def consume(hexstr):
+            for r in intelhex.iter_records(StringIO(hexstr)):
+                pass
+        self.assertRaisesMsg(RecordChecksumError,
+                             'Record at line 2 has invalid checksum',
+                             consume, ':0100000000FF\n:0100010000FF\n')
+        self.assertRaisesMsg(DuplicateStartAddressRecordError,
+                             'Start Address Record appears twice at line 2',
+                             consume, ':0400000512345678E3\n'
+                                      ':0400000512345678E3\n')
+
+    def test_file_name(self):
+        handle, fname = tempfile.mkstemp()
+        os.close(handle)
+        try:
+            f = open(fname, 'w')
+            try:
+                f.write(hex8)
+            finally:
+                f.close()
+            n = sum([len(d) for t, a, d in intelhex.iter_records(fname)])
+            self.assertEqual(len(bin8), n)
+        finally:
+            os.remove(fname)
+
+
 class TestHex2Bin(unittest.TestCase):
 
     def setUp(self):
@@ -1599,6 +2838,117 @@ class TestHex2Bin(unittest.TestCase):
                              "Data different at address "
                              "%x (%x != %x)" % (addr, expected, actual))
 
+    def _convert(self, hexstr, stream, **kwargs):
+        fout = BytesIO()
+        self.assertEqual(0, hex2bin(StringIO(hexstr), fout,
+                                    stream=stream, **kwargs))
+        return fout.getvalue()
+
+    def test_hex2bin_stream(self):
+        ih = IntelHex({0x10: 1, 0x11: 2, 0x100: 3, 0x10002: 4})
+        sio = StringIO()
+        ih.write_hex_file(sio)
+        hexstr = sio.getvalue()
+        for kwargs in ({},
+                       {'start': 0, 'end': 0x20},
+                       {'start': 0x11},
+                       {'end': 0x10010},
+                       {'start': 0x80, 'size': 0x100},
+                       {'end': 0x7F, 'size': 0x100, 'pad': 0},
+                       {'size': 10},
+                       {'start': 0x20000, 'end': 0x10},
+                      ):
+            self.assertEqual(self._convert(hexstr, False, **kwargs),
+                             self._convert(hexstr, True, **kwargs),
+                             kwargs)
+
+    def test_hex2bin_stream_out_of_order(self):
+        hexstr = (':0100100002ED\n'
+                  ':0100000001FE\n'
+                  ':00000001FF\n')
+        self.assertEqual(b'\x01' + b'\xFF'*15 + b'\x02',
+                         self._convert(hexstr, True))
+
+    def test_hex2bin_stream_bad_file(self):
+        fd, fout = tempfile.mkstemp()
+        os.write(fd, b'old data')
+        os.close(fd)
+        try:
+            stdout = sys.stdout
+            sys.stdout = StringIO()
+            try:
+                self.assertEqual(1, hex2bin(StringIO(':0100000000FF\n'
+                                                     ':0100010000FF\n'),
+                                            fout, stream=True))
+            finally:
+                sys.stdout = stdout
+            # existing output file is not changed
+            f = open(fout, 'rb')
+            try:
+                self.assertEqual(b'old data', f.read())
+            finally:
+                f.close()
+            self.assertEqual([os.path.basename(fout)],
+                             [name for name in
+                              os.listdir(os.path.dirname(fout))
+                              if name.startswith(os.path.basename(fout))])
+            # missing input is not reported as output error
+            missing = fout + '.no-such-file.hex'
+            self.assertRaises(IOError, hex2bin, missing, fout, stream=True)
+            self.assertRaises(IOError, hex2bin, missing, fout)
+        finally:
+            if os.path.exists(fout):
+                os.remove(fout)
+
+    def test_hex2bin_stream_file_not_at_end(self):
+        # data after position of output file object is not lost on error,
+        # conversion falls back to loading whole hex file
+        fout = BytesIO(b'old data')
+        self.assertEqual(0, hex2bin(StringIO(':0100000001FE\n:00000001FF\n'),
+                                    fout, stream=True))
+        self.assertEqual(b'\x01ld data', fout.getvalue())
+
+
+class TestBin2Hex(unittest.TestCase):
+
+    def _expected(self, data, offset):
+        ih = IntelHex()
+        ih.frombytes(array.array('B', data), offset)
+        sio = StringIO()
+        ih.write_hex_file(sio)
+        return sio.getvalue()
+
+    def test_bin2hex(self):
+        data = asbytes(''.join([chr(i & 0xFF) for i in range_g(0x30000)]))
+        for size, offset in ((0, 0), (100, 0), (100, 0xFFF0),
+                             (0x10000, 0), (0x10001, 0), (0x30000, 0x1234)):
+            fout = StringIO()
+            self.assertEqual(0, bin2hex(BytesIO(data[:size]), fout, offset))
+            self.assertEqual(self._expected(data[:size], offset),
+                             fout.getvalue())
+
+    def test_bin2hex_file_name(self):
+        data = asbytes(''.join([chr(i & 0xFF) for i in range_g(0x28000)]))
+        fd, fin = tempfile.mkstemp()
+        os.write(fd, data)
+        os.close(fd)
+        try:
+            fout = StringIO()
+            self.assertEqual(0, bin2hex(fin, fout, 0x8000))
+            self.assertEqual(self._expected(data, 0x8000), fout.getvalue())
+        finally:
+            os.remove(fin)
+
+    def test_chunks(self):
+        data = asbytes('\0' * 0x50000)
+        chunks = [(a, len(d))
+                  for a, d in intelhex._iter_bin_chunks(BytesIO(data), 0x100,
+                                                        0x20000)]
+        self.assertEqual([(0x100, 0x1FF00),
+                          (0x20000, 0x20000),
+                          (0x40000, 0x10100)],
+                         chunks)
+
 
 class TestDiffDumps(unittest.TestCase):
 
@@ -1831,6 +3181,31 @@ class TestWriteHexFileByteCount(unittest.TestCase):
         self.assertEqual(ih.tobinstr(), ih2.tobinstr(),
                          "Written hex file does not equal with original")
 
+    def test_write_hex_file_many_records(self):
+        # all records of block are encoded in bulk: check them against
+        # records built one by one, including max checksum sums
+        # and 64K boundary inside the block
+        data = [0xFF] * 700 + list(range_g(256)) * 3
+        ih = IntelHex()
+        ih.frombytes(data, 0xFD00)
+        for byte_count in (1, 16, 255):
+            expected = []
+            addr = 0xFD00
+            high = None
+            while addr < 0xFD00 + len(data):
+                if addr >> 16 != high:
+                    high = addr >> 16
+                    expected.append(Record.extended_linear_address(high))
+                n = min(byte_count, 0x10000 - (addr & 0xFFFF),
+                        0xFD00 + len(data) - addr)
+                expected.append(Record.data(addr & 0xFFFF,
+                                            data[addr-0xFD00:addr-0xFD00+n]))
+                addr += n
+            expected.append(Record.eof())
+            sio = StringIO()
+            ih.write_hex_file(sio, byte_count=byte_count)
+            self.assertEqual('\n'.join(expected) + '\n', sio.getvalue())
+
 ##
 # MAIN
 if __name__ == '__main__':